@@ -13,43 +13,175 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from sklearn.svm import LinearSVC
+from sklearn.linear_model import SGDClassifier, LogisticRegression
+from sklearn.base import clone
 # from b4msa.textmodel import TextModel
+import os
+import copy
 import numpy as np
-from b4msa.utils import read_data_labels, read_data
+from b4msa.utils import read_data_labels, read_data, save_arrays, load_arrays
+from b4msa.utils import tweet_iterator, batches, collapse_duplicates, share_arrays, attach_arrays
+from b4msa.utils import stratified_subsample
 from gensim.matutils import corpus2csc
 from sklearn import preprocessing
+from sklearn.feature_selection import SelectKBest, chi2, mutual_info_classif
 from sklearn.model_selection import StratifiedKFold
-from b4msa.textmodel import TextModel
+from b4msa.textmodel import TextModel, Vocabulary, MinHash, TokenCache, StringTable
 from multiprocessing import Pool
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    from sklearn.externals.joblib import Parallel, delayed
 import logging
 logging.basicConfig(format='%(asctime)s : %(levelname)s :%(message)s')
 
 
+# linear classifiers that can be used by SVC, all of them provide fit, decision_function,
+# coef_ and intercept_
+BACKENDS = dict(
+    liblinear=(LinearSVC, dict()),
+    liblinear_primal=(LinearSVC, dict(dual=False, tol=1e-3)),
+    sgd=(SGDClassifier, dict(loss='hinge', max_iter=20, tol=1e-3)),
+    saga=(LogisticRegression, dict(solver='saga', multi_class='ovr', tol=1e-3)),
+)
+
+
+def _fit_binary(estimator, X, y):
+    return estimator.fit(X, y)
+
+
+def get_backend(name, **kwargs):
+    """Instance of the classifier `name` of BACKENDS, `kwargs` overwrite its parameters"""
+    cls, params = BACKENDS[name]
+    params = dict(params)
+    params.update(kwargs)
+    return cls(**params)
+
+
+def regularization(name, C, n_samples):
+    """Parameters of the backend `name` equivalent to the regularization constant `C`"""
+    if BACKENDS[name][0] is SGDClassifier:
+        return dict(alpha=1. / (C * n_samples))
+    return dict(C=C)
+
+
 class SVC(object):
-    def __init__(self, model):
-        self.svc = LinearSVC()
+    # parameters of a configuration that belong to the classifier instead of TextModel
+    PARAMS = ['select_k', 'select_score', 'backend', 'C']
+
+    def __init__(self, model, n_jobs=None, random_state=0, select_k=None, select_score='chi2',
+                 backend='liblinear', C=None):
+        """With `n_jobs` the one-vs-rest problems are trained in parallel; the result
+        does not depend on the number of jobs. With `select_k` only the `select_k` terms
+        with the highest `select_score` ('chi2' or 'mutual_info') are used. `backend`
+        is the linear classifier, see BACKENDS, and `C` its regularization constant
+        (the default of the backend when it is None)."""
+        self.svc = get_backend(backend, random_state=random_state)
+        self.backend = backend
+        self.C = C
         self.model = model
         self.num_terms = -1
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.select_k = select_k
+        self.select_score = select_score
+        self.selected = None
+
+    @classmethod
+    def split_params(cls, params):
+        """Splits a configuration into the parameters of TextModel and those of the classifier"""
+        textmodel = {k: v for k, v in params.items() if k not in cls.PARAMS}
+        svc = {k: v for k, v in params.items() if k in cls.PARAMS}
+        return textmodel, svc
+
+    def fit(self, X, y, sample_weight=None):
+        """Trains the SVM; `sample_weight` is the number of copies of each vector
+        (see b4msa.utils.collapse_duplicates)"""
+        X = corpus2csc(X, num_terms=len(self.model.dictionary)).T
+        return self.fit_matrix(X, y, sample_weight=sample_weight)
 
-    def fit(self, X, y):
-        X = corpus2csc(X).T
+    def fit_matrix(self, X, y, sample_weight=None):
+        """Trains the SVM on the sparse matrix `X`, whose columns are the terms of the model"""
         self.num_terms = X.shape[1]
         self.le = preprocessing.LabelEncoder()
         self.le.fit(y)
         y = self.le.transform(y)
+        if sample_weight is not None:
+            # liblinear ignores sample_weight with the hinge losses of LinearSVC in some
+            # scikit-learn versions, the rows of the tokenized vectors are repeated instead
+            rows = np.repeat(np.arange(X.shape[0]), np.asarray(sample_weight).astype(np.int64))
+            X, y = X.tocsr()[rows], y[rows]
         if self.num_terms == 0:
             return self
-        self.svc.fit(X, y)
+        if getattr(self, 'select_k', None) is not None and self.select_k < self.num_terms:
+            self.selected = self.feature_selection(X, y)
+            X = self.select(X)
+        if getattr(self, 'C', None) is not None:
+            self.svc.set_params(**regularization(self.backend, self.C, X.shape[0]))
+        if len(self.le.classes_) <= 2:
+            self.svc.fit(X, y)
+            return self
+        self.svc = self.fit_one_vs_rest(X.tocsr(), y)
         return self
 
+    def fit_one_vs_rest(self, X, y):
+        """Trains a binary classifier per class, in parallel with `n_jobs` processes, and
+        stores their coefficients in the backend; the result does not depend on `n_jobs`.
+        With warm_start, the coefficients of the previous fit are the starting point."""
+        svc = self.svc
+        classes = np.unique(y)
+        warm = svc.get_params().get('warm_start') and getattr(svc, 'coef_', None) is not None and \
+            svc.coef_.shape == (len(classes), X.shape[1])
+        estimators = []
+        for k in range(len(classes)):
+            m = clone(svc)
+            if warm:
+                m.coef_, m.intercept_ = svc.coef_[k:k + 1].copy(), svc.intercept_[k:k + 1].copy()
+            estimators.append(m)
+        estimators = Parallel(n_jobs=getattr(self, 'n_jobs', None))(
+            delayed(_fit_binary)(m, X, (y == klass).astype(np.int64)) for m, klass in zip(estimators, classes))
+        svc.coef_ = np.vstack([m.coef_ for m in estimators])
+        svc.intercept_ = np.concatenate([m.intercept_ for m in estimators])
+        svc.classes_ = classes
+        svc.n_iter_ = max([np.max(m.n_iter_) for m in estimators])
+        return svc
+
+    def feature_selection(self, X, y):
+        """Ids of the `select_k` terms with the highest score"""
+        score = dict(chi2=chi2, mutual_info=mutual_info_classif)[self.select_score]
+        selector = SelectKBest(score, k=self.select_k).fit(X, y)
+        return selector.get_support(indices=True)
+
+    def select(self, X):
+        """Keeps the selected columns of `X`, the rows are normalized again"""
+        return preprocessing.normalize(X.tocsc()[:, self.selected].tocsr())
+
+    def tonp(self, X):
+        """Sparse matrix of the vectors `X`; terms added to the model after
+        fitting (see TextModel.update) are ignored"""
+        if len(self.model.dictionary) > self.num_terms:
+            X = [[(k, v) for k, v in x if k < self.num_terms] for x in X]
+        X = corpus2csc(X, num_terms=self.num_terms).T
+        if getattr(self, 'selected', None) is not None:
+            X = self.select(X)
+        return X
+
+    def predict_matrix(self, X):
+        """Labels of the rows of the sparse matrix `X`, whose columns are the terms of the model"""
+        if self.num_terms == 0:
+            return self.le.inverse_transform(np.zeros(X.shape[0], dtype=np.int))
+        if getattr(self, 'selected', None) is not None:
+            X = self.select(X)
+        return self.le.inverse_transform(self.svc.predict(X))
+
     def decision_function(self, Xnew):
-        Xnew = corpus2csc(Xnew, num_terms=self.num_terms).T
+        Xnew = self.tonp(Xnew)
         return self.svc.decision_function(Xnew)
 
     def predict(self, Xnew):
         if self.num_terms == 0:
             return self.le.inverse_transform(np.zeros(len(Xnew), dtype=np.int))
-        Xnew = corpus2csc(Xnew, num_terms=self.num_terms).T
+        Xnew = self.tonp(Xnew)
         ynew = self.svc.predict(Xnew)
         return self.le.inverse_transform(ynew)
 
@@ -57,6 +189,39 @@ class SVC(object):
         y = self.predict([self.model[text]])
         return y[0]
 
+    def predict_q_voc_ratio(self, texts, decision_function=False):
+        """Predictions, or decision functions, of `texts` and their ratios of known tokens"""
+        X, qv = self.model.transform_q_voc_ratio_batch(texts)
+        hy = self.decision_function(X) if decision_function else self.predict(X)
+        return hy, qv
+
+    def predict_iter(self, texts, chunk_size=1024, decision_function=False):
+        """Yields the pairs (prediction, ratio of known tokens) of the iterable `texts`,
+        which is processed in chunks of `chunk_size` texts"""
+        for chunk in batches(texts, chunk_size):
+            hy, qv = self.predict_q_voc_ratio(chunk, decision_function=decision_function)
+            for x in zip(hy, qv.tolist()):
+                yield x
+
+    def fold(self):
+        """Folds the IDF weights into the coefficients of the linear SVM, see FoldedSVC"""
+        idfs = self.model.get_idfs()
+        nclasses = len(self.le.classes_)
+        nclasses = 1 if nclasses == 2 else nclasses
+        coef = np.zeros((idfs.shape[0], nclasses))
+        intercept = np.zeros(nclasses)
+        if self.num_terms > 0:
+            if getattr(self, 'selected', None) is None:
+                coef[:self.num_terms] = self.svc.coef_.T
+            else:
+                # the dropped terms do not contribute to the norm either
+                coef[self.selected] = self.svc.coef_.T
+                keep = np.zeros(idfs.shape[0], dtype=np.bool)
+                keep[self.selected] = True
+                idfs[~keep] = 0
+            intercept[:] = self.svc.intercept_
+        return FoldedSVC(self.model, idfs, idfs[:, np.newaxis] * coef, intercept, self.le.classes_)
+
     def fit_file(self, fname, get_tweet='text',
                  get_klass='klass', maxitems=1e100):
         X, y = read_data_labels(fname, get_klass=get_klass,
@@ -72,62 +237,429 @@ class SVC(object):
 
     @classmethod
     def predict_kfold(cls, X, y, n_folds=10, seed=0, textModel_params={},
-                      kfolds=None, pool=None, use_tqdm=True):
+                      kfolds=None, pool=None, use_tqdm=True, sample_weight=None, dedup=False,
+                      normalized=None):
+        """Predicts `X` with k-fold cross-validation. With `dedup` the identical (text, label)
+        pairs are collapsed into a weighted sample before splitting, so the copies of
+        a text are in the same fold; `kfolds` then indexes the unique pairs. `normalized`
+        is a NormalizedCache shared by the configurations evaluated on `X`; with `pool`,
+        the texts are tokenized in parts by its processes instead, see token_cache_pool."""
         try:
             from tqdm import tqdm
         except ImportError:
             def tqdm(x, **kwargs):
                 return x
 
+        inverse = None
+        if dedup:
+            X, y, sample_weight, inverse = collapse_duplicates(X, y)
         le = preprocessing.LabelEncoder().fit(y)
         y = np.array(le.transform(y))
         hy = np.zeros(len(y), dtype=np.int)
         if kfolds is None:
             kfolds = StratifiedKFold(n_splits=n_folds, shuffle=True,
                                      random_state=seed).split(X, y)
-        args = [(X, y, tr, ts, textModel_params) for tr, ts in kfolds]
+        kfolds = list(kfolds)
         if pool is not None:
-            if use_tqdm:
-                res = [x for x in tqdm(pool.imap_unordered(cls.train_predict_pool, args),
-                                       desc='Params', total=len(args))]
-            else:
-                res = [x for x in pool.imap_unordered(cls.train_predict_pool, args)]
+            cache = cls.token_cache_pool(X, textModel_params, pool, len(kfolds))
+            data = cls.share_data(cache, y, sample_weight)
+            args = [(data, tr, ts, textModel_params) for tr, ts in kfolds]
+            try:
+                if use_tqdm:
+                    res = [x for x in tqdm(pool.imap_unordered(cls.train_predict_pool, args),
+                                           desc='Params', total=len(args))]
+                else:
+                    res = [x for x in pool.imap_unordered(cls.train_predict_pool, args)]
+            finally:
+                os.unlink(data)
         else:
+            cache = cls.token_cache(X, textModel_params, normalized=normalized)
+            args = [((cache, y, sample_weight), tr, ts, textModel_params) for tr, ts in kfolds]
             if use_tqdm:
                 args = tqdm(args)
             res = [cls.train_predict_pool(x) for x in args]
         for ts, _hy in res:
             hy[ts] = _hy
+        if inverse is not None:
+            hy = hy[inverse]
         return le.inverse_transform(hy)
 
+    @classmethod
+    def token_cache(cls, X, textModel_params, normalized=None):
+        """Tokens of `X` with the TextModel of the configuration, see fold_model"""
+        textModel_params, _ = cls.split_params(textModel_params)
+        return TokenCache.from_texts(TextModel([], **textModel_params), X, normalized=normalized)
+
+    @classmethod
+    def token_cache_pool(cls, X, textModel_params, pool, chunks):
+        """Same as token_cache with `X` tokenized in `chunks` parts by the processes of `pool`"""
+        limits = [len(X) * i // chunks for i in range(chunks + 1)]
+        args = [(X[a:b], textModel_params) for a, b in zip(limits, limits[1:])]
+        return TokenCache.merge(pool.map(cls.token_cache_task, args))
+
+    @classmethod
+    def token_cache_task(cls, args):
+        X, textModel_params = args
+        return cls.token_cache(X, textModel_params)
+
+    @classmethod
+    def fold_model(cls, cache, tr, ts, textModel_params):
+        """TextModel of the training part of a fold, computed from the TokenCache `cache` instead
+        of tokenizing again, and the TF-IDF matrices of the training and test parts"""
+        textModel_params, _ = cls.split_params(textModel_params)
+        t = TextModel([], **textModel_params)
+        vocabulary, newids = cache.vocabulary(ts, min_df=t.min_df, max_df=t.max_df,
+                                              max_features=t.max_features)
+        t.dictionary = t.model = vocabulary
+        return t, cache.tfidf(vocabulary, newids, tr), cache.tfidf(vocabulary, newids, ts)
+
+    @classmethod
+    def share_data(cls, cache, y, sample_weight=None):
+        """Stores the TokenCache, the labels and the weights of the samples in a file that
+        the pool processes memory-map (see get_data), so the tasks only carry its name"""
+        header, arrays = cache.get_arrays()
+        arrays['y'] = np.asarray(y)
+        if sample_weight is not None:
+            arrays['sample_weight'] = np.asarray(sample_weight)
+        return share_arrays(arrays, header)
+
+    @classmethod
+    def get_data(cls, data):
+        """TokenCache, labels and weights of the samples given directly or by share_data"""
+        if not isinstance(data, str):
+            return data
+
+        header, arrays = attach_arrays(data)
+        return TokenCache.from_arrays(header, arrays), arrays['y'], arrays.get('sample_weight')
+
     @classmethod
     def train_predict_pool(cls, args):
-        X, y, tr, ts, textModel_params = args
-        t = TextModel([X[x] for x in tr], **textModel_params)
-        m = cls(t).fit([t[X[x]] for x in tr], [y[x] for x in tr])
-        return ts, np.array(m.predict([t[X[x]] for x in ts]))
+        data, tr, ts, textModel_params = args
+        cache, y, sample_weight = cls.get_data(data)
+        t, Xtr, Xts = cls.fold_model(cache, tr, ts, textModel_params)
+        w = None if sample_weight is None else sample_weight[tr]
+        m = cls(t, **cls.split_params(textModel_params)[1])
+        m.fit_matrix(Xtr, [y[x] for x in tr], sample_weight=w)
+        return ts, np.array(m.predict_matrix(Xts))
 
     @classmethod
-    def predict_kfold_params(cls, fname, n_folds=10, score=None, numprocs=None, seed=0, param_kwargs={}):
-        from b4msa.params import ParameterSelection, Wrapper
-        X, y = read_data_labels(fname)
-        if numprocs is not None:
-            pool = Pool(numprocs)
+    def predict_kfold_path(cls, X, y, Cs, n_folds=10, seed=0, textModel_params={},
+                           kfolds=None, pool=None, use_tqdm=True, sample_weight=None, normalized=None):
+        """Predicts `X` with k-fold cross-validation for each regularization constant in `Cs`;
+        each fold is tokenized once, and the SVM is trained on the same TF-IDF matrix from
+        the smallest to the largest C, with warm starts when the backend supports them.
+        With `pool` the texts are tokenized as in predict_kfold. Returns a dictionary from
+        C to the predictions."""
+        try:
+            from tqdm import tqdm
+        except ImportError:
+            def tqdm(x, **kwargs):
+                return x
+
+        le = preprocessing.LabelEncoder().fit(y)
+        y = np.array(le.transform(y))
+        hy = {C: np.zeros(len(y), dtype=np.int) for C in Cs}
+        if kfolds is None:
+            kfolds = StratifiedKFold(n_splits=n_folds, shuffle=True,
+                                     random_state=seed).split(X, y)
+        kfolds = list(kfolds)
+        if pool is None:
+            data = (cls.token_cache(X, textModel_params, normalized=normalized), y, sample_weight)
         else:
-            pool = None
-            numprocs = 1
+            cache = cls.token_cache_pool(X, textModel_params, pool, len(kfolds))
+            data = cls.share_data(cache, y, sample_weight)
+        args = [(data, tr, ts, textModel_params, Cs) for tr, ts in kfolds]
+        try:
+            if pool is not None:
+                res = pool.imap_unordered(cls.train_predict_path_pool, args)
+            else:
+                res = (cls.train_predict_path_pool(x) for x in args)
+            if use_tqdm:
+                res = tqdm(res, desc='C path', total=len(args))
+            for ts, _hy in res:
+                for C, v in _hy.items():
+                    hy[C][ts] = v
+        finally:
+            if pool is not None:
+                os.unlink(data)
+        return {C: le.inverse_transform(v) for C, v in hy.items()}
 
-        if n_folds % numprocs == 0:
-            f = Wrapper(X, y, score, n_folds, cls, pool=pool, seed=seed)
-            pool = None
+    @classmethod
+    def train_predict_path_pool(cls, args):
+        data, tr, ts, textModel_params, Cs = args
+        cache, y, sample_weight = cls.get_data(data)
+        t, Xtr, Xts = cls.fold_model(cache, tr, ts, textModel_params)
+        svc_params = cls.split_params(textModel_params)[1]
+        svc_params.pop('C', None)
+        m = cls(t, **svc_params)
+        if 'warm_start' in m.svc.get_params():
+            m.svc.set_params(warm_start=True)
+        w = None if sample_weight is None else sample_weight[tr]
+        hy = {}
+        for C in sorted(Cs):
+            m.C = C
+            m.fit_matrix(Xtr, [y[x] for x in tr], sample_weight=w)
+            hy[C] = np.array(m.predict_matrix(Xts))
+        return ts, hy
+
+    @classmethod
+    def predict_kfold_params(cls, fname, n_folds=10, score=None, numprocs=None, seed=0, param_kwargs={},
+                             dedup=False, Cs=None, halving=None, subsample=None, refine=5):
+        """Searches the configuration with the best k-fold score on `fname`; with `halving`,
+        an integer greater than one, the candidates are selected by successive halving
+        on 1, ..., n_folds / halving folds, keeping the best 1 / halving each time.
+        With `subsample`, the search runs on a stratified sample of at most `subsample`
+        texts per label, and the best `refine` configurations are scored on all the texts
+        (see ParameterSelection.refine)"""
+        from b4msa.params import ParameterSelection, Wrapper, attach_dataset
+        X, y = read_data_labels(fname)
+        if halving:
+            budgets = []
+            b = n_folds // halving
+            while b >= 1:
+                budgets.insert(0, b)
+                b //= halving
+            param_kwargs = dict(param_kwargs, budgets=budgets, eta=halving)
+        if subsample:
+            index = stratified_subsample(y, subsample, seed=seed)
+            f = Wrapper([X[i] for i in index], [y[i] for i in index], score, n_folds, cls,
+                        seed=seed, dedup=dedup, Cs=Cs)
         else:
-            f = Wrapper(X, y, score, n_folds, cls, seed=seed)
+            f = Wrapper(X, y, score, n_folds, cls, seed=seed, dedup=dedup, Cs=Cs)
+        pool = None
+        wrappers = [f]
+
+        def get_scheduler(f):
+            if pool is None:
+                return None
+            if f.filename is None:
+                f.share()
+                wrappers.append(f)
+
+            def scheduler(cand):
+                return f.imap(cand, pool, max_configs=numprocs, chunks=numprocs)
+            return scheduler
 
-        return ParameterSelection().search(f.f, pool=pool, **param_kwargs)
+        if numprocs is not None:
+            # one task per (configuration, fold) pair, see Wrapper.imap; the processes read the
+            # dataset from a shared file instead of receiving it with each task
+            pool = Pool(numprocs, initializer=attach_dataset, initargs=(f.share(),))
+
+        try:
+            search = ParameterSelection()
+            best_list = search.search(f.f, scheduler=get_scheduler(f), **param_kwargs)
+            if not subsample:
+                return best_list
+            full = Wrapper(X, y, score, n_folds, cls, seed=seed, dedup=dedup, Cs=Cs)
+            return search.refine(best_list, full.f, top=refine, scheduler=get_scheduler(full))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                for w in wrappers:
+                    if w.filename is not None:
+                        os.unlink(w.filename)
 
     @classmethod
-    def fit_from_file(cls, fname, textModel_params={}):
+    def fit_from_file(cls, fname, textModel_params={}, dedup=False, **kwargs):
+        """Trains on `fname`; with `dedup` the identical (text, label) pairs are collapsed
+        into one weighted sample before building the TextModel, and with dedup='near'
+        also the texts whose tokens are similar (see MinHash); in this case the texts are
+        tokenized once, for the signatures and the TF-IDF vectors (see fold_model)"""
         X, y = read_data_labels(fname)
+        sample_weight = None
+        textModel_params, svc_params = cls.split_params(textModel_params)
+        svc_params.update(kwargs)
+        if dedup == 'near':
+            cache = cls.token_cache(X, textModel_params)
+            minhash = MinHash()
+            _, y, sample_weight, inverse = minhash.collapse(None, X, y, signatures=minhash.cache_signatures(cache))
+            tr = np.unique(inverse, return_index=True)[1]
+            model, Xtr, _ = cls.fold_model(cache, tr, np.setdiff1d(np.arange(len(X)), tr), textModel_params)
+            return cls(model, **svc_params).fit_matrix(Xtr, y, sample_weight=sample_weight)
+        elif dedup:
+            X, y, sample_weight, _ = collapse_duplicates(X, y)
         model = TextModel(X, **textModel_params)
-        svc = cls(model)
-        return svc.fit([model[x] for x in X], y)
+        svc = cls(model, **svc_params)
+        return svc.fit([model[x] for x in X], y, sample_weight=sample_weight)
+
+
+class OnlineSVC(SVC):
+    """Linear SVM trained with stochastic gradient descent (hinge loss) on mini-batches,
+    so the training set does not need to fit in memory. The vocabulary of the model
+    can grow between mini-batches (see TextModel.update) or have a fixed width,
+    e.g., in hashing mode; the weights of new terms start at zero."""
+    def __init__(self, model, classes=None, random_state=0, **kwargs):
+        super(OnlineSVC, self).__init__(model, random_state=random_state)
+        self.svc = SGDClassifier(loss='hinge', random_state=random_state, **kwargs)
+        self.num_terms = 0
+        if classes is not None:
+            self.le = preprocessing.LabelEncoder().fit(classes)
+
+    def partial_fit(self, X, y, classes=None, sample_weight=None):
+        """Updates the SVM with the vectors `X`; the labels must be given in `classes`,
+        or in the constructor, if `y` does not contain all of them"""
+        if not hasattr(self, 'le'):
+            self.le = preprocessing.LabelEncoder().fit(y if classes is None else classes)
+        num_terms = len(self.model.dictionary)
+        coef = getattr(self.svc, 'coef_', None)
+        if coef is not None and coef.shape[1] < num_terms:
+            self.svc.coef_ = np.hstack([coef, np.zeros((coef.shape[0], num_terms - coef.shape[1]))])
+        self.num_terms = num_terms
+        X = corpus2csc(X, num_terms=num_terms).T
+        self.svc.partial_fit(X, self.le.transform(y), classes=np.arange(len(self.le.classes_)),
+                             sample_weight=sample_weight)
+        return self
+
+    def fit_file(self, fname, get_tweet='text', get_klass='klass', maxitems=1e100,
+                 batch_size=1024, update=True):
+        """Trains on `fname` reading mini-batches of `batch_size` tweets; with `update`
+        the tweets are also added to the model (TextModel.update)"""
+        def get(tweet, key):
+            return key(tweet) if callable(key) else tweet[key]
+
+        if not hasattr(self, 'le'):
+            self.le = preprocessing.LabelEncoder().fit([get(tw, get_klass) for tw in tweet_iterator(fname)])
+        count = 0
+        for batch in batches(tweet_iterator(fname), batch_size):
+            batch = batch[:int(min(len(batch), maxitems - count))]
+            count += len(batch)
+            # each text is tokenized once, for the update of the model and for its vector
+            tokens = [self.model.tokenize(get(tw, get_tweet)) for tw in batch]
+            if update:
+                self.model.update(tokens, tokenized=True)
+            self.partial_fit([self.model.vector(x) for x in tokens], [get(tw, get_klass) for tw in batch])
+            if count >= maxitems:
+                break
+        return self
+
+
+class FoldedSVC(object):
+    """Linear SVM applied to TF-IDF vectors, with the IDF folded into the coefficients.
+    The decision function of a text is the sum of tf * weights over its tokens,
+    divided by the L2 norm of its tf * idf vector, plus the intercept; hence, a text
+    is scored with a lookup per token and neither scipy nor sklearn are used.
+    The gensim dictionary of `model` is converted once to a Vocabulary, on a copy."""
+    def __init__(self, model, idfs, weights, intercept, classes, scales=None):
+        if not isinstance(model.model, Vocabulary):
+            model = copy.copy(model).compact()
+        self.model = model
+        self.idfs = idfs
+        self.weights = weights
+        self.intercept = intercept
+        self.classes_ = classes
+        self.scales = scales
+        self.num_terms = weights.shape[0]
+
+    def decision_function(self, texts):
+        doc, ids, counts, _ = self.model.count_known(texts)
+        return self.score(doc, ids, counts, len(texts))
+
+    def score(self, doc, ids, counts, size):
+        """Decision function of `size` texts given as the output of TextModel.count_known"""
+        known = ids < self.idfs.shape[0]
+        doc, ids, counts = doc[known], ids[known], counts[known]
+        norm = np.sqrt(np.bincount(doc, weights=(counts * self.idfs[ids]) ** 2, minlength=size))
+        norm[norm == 0] = 1
+        w = self.weights[ids]
+        if self.scales is not None:
+            w = w * self.scales
+        hy = np.array([np.bincount(doc, weights=counts * w[:, k], minlength=size)
+                       for k in range(w.shape[1])]).T
+        hy = hy / norm[:, np.newaxis] + self.intercept
+        if hy.shape[1] == 1:
+            return hy[:, 0]
+        return hy
+
+    def decision_to_labels(self, hy):
+        if hy.ndim == 1:
+            return self.classes_[(hy > 0).astype(np.int)]
+        return self.classes_[hy.argmax(axis=1)]
+
+    def predict(self, texts):
+        return self.decision_to_labels(self.decision_function(texts))
+
+    def predict_text(self, text):
+        return self.predict([text])[0]
+
+    def predict_q_voc_ratio(self, texts, decision_function=False):
+        """Predictions, or decision functions, of `texts` and their ratios of known tokens"""
+        doc, ids, counts, qv = self.model.count_known(texts)
+        hy = self.score(doc, ids, counts, len(qv))
+        return (hy if decision_function else self.decision_to_labels(hy)), qv
+
+    def predict_iter(self, texts, chunk_size=1024, decision_function=False):
+        """Yields the pairs (prediction, ratio of known tokens) of the iterable `texts`,
+        which is processed in chunks of `chunk_size` texts"""
+        for chunk in batches(texts, chunk_size):
+            hy, qv = self.predict_q_voc_ratio(chunk, decision_function=decision_function)
+            for x in zip(hy, qv.tolist()):
+                yield x
+
+    def quantize(self, dtype='int8'):
+        """Copy of the model with the weights stored as float16, or as int8 with a scale
+        per class; in both cases the IDF weights are stored as float32, since they are
+        one per term and their rounding would dominate the error of the int8 weights"""
+        if dtype == 'float16':
+            weights, scales = self.weights.astype(np.float16), None
+        elif dtype == 'int8':
+            scales = np.ones(self.weights.shape[1])
+            if self.weights.shape[0]:
+                scales = np.fabs(self.weights).max(axis=0) / 127.
+                scales[scales == 0] = 1
+            weights = np.round(self.weights / scales).astype(np.int8)
+        else:
+            raise ValueError("Unknown dtype {0}".format(dtype))
+        return FoldedSVC(self.model, self.idfs.astype(np.float32), weights, self.intercept,
+                         self.classes_, scales=scales)
+
+    def prune(self, exact=True):
+        """Copy of the model without the terms whose weights are zero in every class. With
+        `exact` a term is also required to have a zero IDF weight, e.g., the terms dropped
+        by the feature selection of SVC, so the decision functions do not change;
+        otherwise the removed terms no longer count in the norm of the vectors."""
+        zero = np.all(self.weights == 0, axis=1)
+        if exact:
+            zero &= self.idfs == 0
+        ids = np.where(~zero)[0]
+        return FoldedSVC(self.model.keep(ids), np.array(self.idfs[ids]), np.array(self.weights[ids]),
+                         self.intercept, self.classes_, scales=self.scales)
+
+    def get_arrays(self):
+        """Header and arrays stored by `save`"""
+        vocabulary = self.model.model
+        arrays = dict(dfs=vocabulary.dfs, idfs=self.idfs, weights=self.weights, intercept=self.intercept)
+        if vocabulary.tokens is not None:
+            arrays.update(vocabulary.tokens.get_arrays('tokens'), ids=vocabulary.ids)
+        if self.scales is not None:
+            arrays.update(scales=self.scales)
+        header = dict(textmodel=self.model.get_params(), num_docs=int(vocabulary.num_docs),
+                      classes=self.classes_.tolist())
+        return header, arrays
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the arrays of the model"""
+        return sum(v.nbytes for v in self.get_arrays()[1].values())
+
+    def save(self, fname):
+        """Stores the model in the binary format of `b4msa.utils.save_arrays`"""
+        header, arrays = self.get_arrays()
+        save_arrays(fname, header, arrays)
+
+    @classmethod
+    def load(cls, fname, mmap_mode='r'):
+        """Loads a model stored with `save`. By default the arrays are memory-mapped
+        read-only, so the load time does not depend on the model size and the
+        processes using the same file share the memory."""
+        header, arrays = load_arrays(fname, mmap_mode=mmap_mode)
+        params = header['textmodel']
+        model = TextModel([], **params)
+        tokens = StringTable.from_arrays(arrays, 'tokens')
+        if tokens is None and 'tokens' in arrays:
+            # version 1 of the format: a fixed-width array of strings
+            tokens = StringTable.from_sorted(arrays['tokens'].tolist())
+        model.dictionary = model.model = Vocabulary(tokens, arrays.get('ids'), arrays['dfs'],
+                                                    arrays['idfs'], header['num_docs'],
+                                                    hash_size=params['hash_size'])
+        return cls(model, arrays['idfs'], arrays['weights'], arrays['intercept'],
+                   np.array(header['classes']), scales=arrays.get('scales'))
@@ -14,13 +14,15 @@
 import argparse
 import logging
 import b4msa
-from b4msa.classifier import SVC
-from b4msa.utils import read_data, tweet_iterator, read_data_labels
+from b4msa.classifier import SVC, FoldedSVC
+from b4msa.utils import tweet_iterator, read_data_labels, is_array_file, batches
 from b4msa.textmodel import TextModel
 # from b4msa.params import OPTION_DELETE
 from multiprocessing import cpu_count
 from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import KFold
+from sklearn.metrics import accuracy_score
+import numpy as np
 import json
 import gzip
 import pickle
@@ -41,6 +43,14 @@ def load_json(filename):
             return json.loads(d)
 
 
+def load_svc(filename):
+    """Loads a model stored by b4msa-train, either pickled or in the binary format"""
+    if is_array_file(filename):
+        return FoldedSVC.load(filename)
+    with open(filename, 'rb') as fpt:
+        return pickle.load(fpt)
+
+
 class CommandLine(object):
     def __init__(self):
         self.parser = argparse.ArgumentParser(description='b4msa')
@@ -90,6 +100,16 @@ class CommandLine(object):
            help="Determines if hillclimbing search is also perfomed to improve the selection of paramters")
         pa('-n', '--numprocs', dest='numprocs', type=int, default=1,
            help="Number of processes to compute the best setup")
+        pa('--dedup', dest='dedup', default=False, action='store_true',
+           help="Collapses the identical (text, label) pairs into a weighted sample")
+        pa('--C-path', dest='Cs', type=str, default=None,
+           help="Comma-separated values of C evaluated for each configuration, e.g., 0.1,1,10; the best one is kept")
+        pa('--halving', dest='halving', type=int, default=None,
+           help="Selects the candidates by successive halving on subsets of the folds, promoting the best 1/HALVING of them each time, e.g., 3")
+        pa('--subsample', dest='subsample', type=int, default=None,
+           help="Searches on a stratified sample with at most SUBSAMPLE texts per label, the best configurations are then scored on the whole training set")
+        pa('--refine', dest='refine', type=int, default=5,
+           help="Number of configurations found on the subsample that are scored on the whole training set")
         pa('-S', '--score', dest='score', type=str, default='macrorecall',
            help="The name of the score to be optimized (macrorecall|macrof1|weightedf1|accuracy|avgf1:klass1:klass2); it defaults to macrof1")
 
@@ -125,6 +145,11 @@ class CommandLine(object):
             score=self.data.score,
             numprocs=numprocs,
             seed=self.data.seed,
+            dedup=self.data.dedup,
+            Cs=None if self.data.Cs is None else [float(x) for x in self.data.Cs.split(',')],
+            halving=self.data.halving,
+            subsample=self.data.subsample,
+            refine=self.data.refine,
             param_kwargs=dict(
                 bsize=self.data.samplesize,
                 hill_climbing=self.data.hill_climbing,
@@ -155,14 +180,39 @@ class CommandLineTrain(CommandLine):
         pa('-m', '--model-params', dest='params_fname', type=str,
            required=True,
            help="TextModel params")
+        pa('-b', '--binary', dest='binary', default=False,
+           action='store_true',
+           help="Stores the model in the binary format instead of pickling it")
+        pa('--dedup', dest='dedup', nargs='?', const='exact', default=None,
+           choices=['exact', 'near'],
+           help="Collapses the identical (text, label) pairs into a weighted sample, or also the near-duplicates (near)")
+        pa('--prune', dest='prune', nargs='?', const='exact', default=None,
+           choices=['exact', 'approx'],
+           help="Removes from the binary model the terms without weight that do not change the predictions, "
+                "i.e., those dropped by select_k (exact), or all of them, which changes the norm of the vectors (approx)")
+        pa('--n-jobs', dest='n_jobs', type=int, default=None,
+           help="Number of processes used to train the one-vs-rest problems")
 
     def main(self):
         self.data = self.parser.parse_args()
         logging.basicConfig(level=self.data.verbose)
+        if self.data.prune and not self.data.binary:
+            self.parser.error("--prune requires the binary format (-b)")
         params_fname = self.data.params_fname
         param_list = load_json(params_fname)
         best = param_list[0]
-        svc = SVC.fit_from_file(self.data.training_set, best)
+        svc = SVC.fit_from_file(self.data.training_set, best, dedup=self.data.dedup,
+                                n_jobs=self.data.n_jobs)
+        if self.data.binary:
+            folded = svc.fold()
+            if self.data.prune:
+                pruned = folded.prune(exact=self.data.prune == 'exact')
+                report = dict(num_terms=folded.num_terms, pruned_num_terms=pruned.num_terms,
+                              nbytes=folded.nbytes, pruned_nbytes=pruned.nbytes)
+                logging.log(logging.INFO + 1, "pruned model: {0}".format(json.dumps(report)))
+                folded = pruned
+            folded.save(self.get_output())
+            return
         with open(self.get_output(), 'wb') as fpt:
             pickle.dump(svc, fpt)
 
@@ -183,6 +233,8 @@ class CommandLineTest(CommandLine):
         pa('--decision-function', dest='decision_function', default=False,
            action='store_true',
            help='Outputs the decision functions instead of the class')
+        pa('--chunk-size', dest='chunk_size', type=int, default=1024,
+           help='Number of tweets predicted at a time')
 
     def training_set(self):
         cdn = 'File containing the test set'
@@ -197,11 +249,7 @@ class CommandLineTest(CommandLine):
     def main(self):
         self.data = self.parser.parse_args()
         logging.basicConfig(level=self.data.verbose)
-        with open(self.data.model, 'rb') as fpt:
-            svc = pickle.load(fpt)
-        X = [svc.model.transform_q_voc_ratio(x) for x in read_data(self.data.test_set)]
-        qv = [x[1] for x in X]
-        X = [x[0] for x in X]
+        svc = load_svc(self.data.model)
         output = self.get_output()
         if output.endswith('.gz'):
             gzip_flag = True
@@ -209,23 +257,20 @@ class CommandLineTest(CommandLine):
         else:
             gzip_flag = False
             output = open(output, 'w')
+        key = 'decision_function' if self.data.decision_function else 'klass'
         with output as fpt:
-            if not self.data.decision_function:
-                hy = svc.predict(X)
-                for tweet, klass, r in zip(tweet_iterator(self.data.test_set), hy, qv):
-                    tweet['klass'] = str(klass)
-                    tweet['q_voc_ratio'] = r
-                    cdn = json.dumps(tweet)+"\n"
-                    cdn = bytes(cdn, encoding='utf-8') if gzip_flag else cdn
-                    fpt.write(cdn)
-            else:
-                hy = svc.decision_function(X)
-                for tweet, klass, r in zip(tweet_iterator(self.data.test_set), hy, qv):
-                    try:
-                        o = klass.tolist()
-                    except AttributeError:
-                        o = klass
-                    tweet['decision_function'] = o
+            for tweets in batches(tweet_iterator(self.data.test_set), self.data.chunk_size):
+                hy, qv = svc.predict_q_voc_ratio([tw['text'] for tw in tweets],
+                                                 decision_function=self.data.decision_function)
+                for tweet, klass, r in zip(tweets, hy, qv.tolist()):
+                    if self.data.decision_function:
+                        try:
+                            klass = klass.tolist()
+                        except AttributeError:
+                            pass
+                    else:
+                        klass = str(klass)
+                    tweet[key] = klass
                     tweet['q_voc_ratio'] = r
                     cdn = json.dumps(tweet)+"\n"
                     cdn = bytes(cdn, encoding='utf-8') if gzip_flag else cdn
@@ -236,8 +281,7 @@ class CommandLineTextModel(CommandLineTest):
     def main(self):
         self.data = self.parser.parse_args()
         logging.basicConfig(level=self.data.verbose)
-        with open(self.data.model, 'rb') as fpt:
-            svc = pickle.load(fpt)
+        svc = load_svc(self.data.model)
         with open(self.get_output(), 'w') as fpt:
             for tw in tweet_iterator(self.data.test_set):
                 extra = dict(svc.model[tw['text']] + [('num_terms', svc.num_terms)])
@@ -245,6 +289,57 @@ class CommandLineTextModel(CommandLineTest):
                 fpt.write(json.dumps(tw) + "\n")
 
 
+class CommandLineQuantize(CommandLineTest):
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(description='b4msa')
+        self.param_set()
+        self.training_set()
+        self.param_quantize()
+        self.version()
+
+    def param_quantize(self):
+        pa = self.parser.add_argument
+        pa('-m', '--model', dest='model', type=str,
+           required=True,
+           help="SVM Model file name")
+        pa('--dtype', dest='dtype', type=str, default='int8',
+           choices=['int8', 'float16'],
+           help="Type used to store the weights (default int8)")
+
+    def get_output(self):
+        if self.data.output is None:
+            return self.data.model + "." + self.data.dtype
+        return self.data.output
+
+    def main(self):
+        self.data = self.parser.parse_args()
+        logging.basicConfig(level=self.data.verbose)
+        svc = load_svc(self.data.model)
+        X, y = read_data_labels(self.data.test_set)
+        if isinstance(svc, FoldedSVC):
+            hy = svc.decision_function(X)
+            svc_hy = svc.decision_to_labels(hy)
+        else:
+            Xvec = [svc.model[x] for x in X]
+            hy = svc.decision_function(Xvec)
+            svc_hy = svc.predict(Xvec)
+            svc = svc.fold()
+        quantized = svc.quantize(self.data.dtype)
+        qhy = quantized.decision_function(X)
+        quantized_hy = quantized.decision_to_labels(qhy)
+        y = [str(x) for x in y]
+        accuracy = accuracy_score(y, [str(x) for x in svc_hy])
+        quantized_accuracy = accuracy_score(y, [str(x) for x in quantized_hy])
+        report = dict(dtype=self.data.dtype, accuracy=accuracy,
+                      quantized_accuracy=quantized_accuracy,
+                      accuracy_delta=quantized_accuracy - accuracy,
+                      agreement=float(np.mean(np.array(svc_hy) == np.array(quantized_hy))),
+                      max_decision_function_error=float(np.fabs(hy - qhy).max()) if len(y) else 0.0)
+        quantized.save(self.get_output())
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return report
+
+
 class CommandLineKfolds(CommandLineTrain):
     def __init__(self):
         super(CommandLineKfolds, self).__init__()
@@ -270,12 +365,13 @@ class CommandLineKfolds(CommandLineTrain):
         le = LabelEncoder()
         le.fit(labels)
         y = le.transform(labels)
+        best, svc_params = SVC.split_params(best)
         t = TextModel(corpus, **best)
         X = [t[x] for x in corpus]
         hy = [None for x in y]
         for tr, ts in KFold(n_splits=self.data.kratio,
                             shuffle=True, random_state=self.data.seed).split(X):
-            c = SVC(model=t)
+            c = SVC(model=t, **svc_params)
             c.fit([X[x] for x in tr], [y[x] for x in tr])
             _ = c.decision_function([X[x] for x in ts])
             [hy.__setitem__(k, v) for k, v in zip(ts, _)]
@@ -309,6 +405,11 @@ def textmodel():
     c.main()
 
 
+def quantize():
+    c = CommandLineQuantize()
+    return c.main()
+
+
 def kfolds(*args, **kwargs):
     c = CommandLineKfolds()
     return c.main(*args, **kwargs)
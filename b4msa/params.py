@@ -1,12 +1,14 @@
 # author: Eric S. Tellez <eric.tellez@infotec.mx>
 # under the same terms than the multilingual benchmark
 
+import os
 import numpy as np
 import logging
 from time import time
 from sklearn.metrics import f1_score, accuracy_score, recall_score, precision_score
 from sklearn import preprocessing
 from sklearn.model_selection import StratifiedKFold
+from b4msa.utils import collapse_duplicates, share_arrays, attach_arrays, texts_to_arrays, arrays_to_texts
 
 try:
     from tqdm import tqdm
@@ -33,6 +35,11 @@ _BASE_PARAMS = dict(
     del_dup1=[False, True],
     # knowledge=[False, True],
     token_list=[-2, -1, 1, 2, 3, 4, 5, 6, 7],
+    min_df=[1, 2, 3, 5],
+    max_df=[0.5, 0.9, 1.0],
+    max_features=[None, 100000, 50000, 10000],
+    select_k=[None, 100000, 10000, 1000],
+    backend=['liblinear', 'liblinear_primal', 'sgd', 'saga'],
 )
 
 _BASE_PARAMS_LANG = dict(
@@ -45,6 +52,11 @@ _BASE_PARAMS_LANG = dict(
     del_dup1=[False, True],
     # knowledge=[False, True],
     token_list=[-2, -1, 1, 2, 3, 4, 5, 6, 7],
+    min_df=[1, 2, 3, 5],
+    max_df=[0.5, 0.9, 1.0],
+    max_features=[None, 100000, 50000, 10000],
+    select_k=[None, 100000, 10000, 1000],
+    backend=['liblinear', 'liblinear_primal', 'sgd', 'saga'],
     negation=[False, True],
     stemming=[False, True],
     stopwords=BASIC_OPTIONS,
@@ -82,7 +94,7 @@ class ParameterSelection:
                 # by convention, metadata starts with underscore
                 continue
             
-            if v in (True, False):
+            if isinstance(v, bool):
                 x = s.copy()
                 x[k] = not v
                 yield x
@@ -106,9 +118,60 @@ class ParameterSelection:
                         l.append(_v)
                         l.sort()
                         yield x
+            elif v in self._base_params.get(k, []):
+                values = self._base_params[k]
+                if isinstance(v, (str, type(u''))):
+                    # categorical parameters, e.g., the classifier backend, move to any other value
+                    neighbors = [_v for _v in values if _v != v]
+                else:
+                    # ordinal parameters, e.g., vocabulary pruning, move to the adjacent values
+                    i = values.index(v)
+                    neighbors = [values[j] for j in (i - 1, i + 1) if 0 <= j < len(values)]
+                for _v in neighbors:
+                    x = s.copy()
+                    x[k] = _v
+                    yield x
+
+    def evaluate(self, fun_score, cand, desc="searching for params", pool=None, scheduler=None):
+        """Scores the list of (conf, code) `cand`, see search; returns the configurations
+        sorted by `_score` in decreasing order"""
+        if scheduler is not None:
+            X = [x for x in tqdm(scheduler(cand), desc=desc, total=len(cand))]
+        elif pool is None:
+            # X = list(map(fun_score, cand))
+            X = [fun_score(x) for x in tqdm(cand, desc=desc, total=len(cand))]
+        else:
+            # X = list(pool.map(fun_score, cand))
+            X = [x for x in tqdm(pool.imap_unordered(fun_score, cand), desc=desc, total=len(cand))]
+
+        # a list of tuples (score, conf)
+        X.sort(key=lambda x: x['_score'], reverse=True)
+        return X
+
+    def refine(self, best_list, fun_score, top=5, pool=None, scheduler=None):
+        """Scores again the first `top` configurations of `best_list`, found on a subsample,
+        with `fun_score`, e.g., on the full dataset. The subsample score and rank of each
+        configuration are kept in `_subsample_score` and `_subsample_rank`."""
+        cand = []
+        for rank, x in enumerate(best_list[:top]):
+            conf = {k: v for k, v in x.items() if k[0] != '_'}
+            conf['_subsample_score'] = x['_score']
+            conf['_subsample_rank'] = rank
+            cand.append((conf, get_filename(conf)))
+
+        return self.evaluate(fun_score, cand, desc="refining", pool=pool, scheduler=scheduler)
 
     def search(self, fun_score, bsize=32, qsize=3,
-               hill_climbing=True, lang=None, pool=None):
+               hill_climbing=True, lang=None, pool=None, scheduler=None, budgets=None, eta=3):
+        """`scheduler`, if given, scores a list of (conf, code) and yields them as they are
+        completed, e.g., Wrapper.imap; otherwise `fun_score` is applied to each pair.
+
+        With `budgets`, an increasing list of numbers of folds, e.g., [1, 3], the candidates are
+        selected with successive halving: all of them are evaluated with the first budget,
+        the best 1/`eta` are promoted to the next one, and so on; the survivors are evaluated
+        with all the folds. `fun_score` and `scheduler` receive (conf, code, budget) in the
+        partial evaluations, and only the fully evaluated configurations are returned, with
+        their partial scores in `_halving`."""
 
         self.lang = lang
         if lang:
@@ -121,17 +184,24 @@ class ParameterSelection:
         tabu = set()  # memory for tabu search
 
         # initial approximation, montecarlo based process
+        def evaluate(cand, desc):
+            return self.evaluate(fun_score, cand, desc=desc, pool=pool, scheduler=scheduler)
+
         def get_best(cand, desc="searching for params"):
-            if pool is None:
-                # X = list(map(fun_score, cand))
-                X = [fun_score(x) for x in tqdm(cand, desc=desc, total=len(cand))]
-            else:
-                # X = list(pool.map(fun_score, cand))
-                X = [x for x in tqdm(pool.imap_unordered(fun_score, cand), desc=desc, total=len(cand))]
+            for budget in (budgets or []):
+                if len(cand) <= 1:
+                    break
+
+                X = evaluate([(conf, code, budget) for conf, code in cand],
+                             desc="{0} ({1} folds)".format(desc, budget))
+                cand = []
+                for x in X[:max(1, int(np.ceil(len(X) / float(eta))))]:
+                    # the metadata, i.e., keys starting with underscore, is replaced by the next evaluation
+                    x['_halving'] = dict(x.get('_halving', {}))
+                    x['_halving'][str(budget)] = x['_score']
+                    cand.append((x, get_filename(x)))
 
-            # a list of tuples (score, conf)
-            X.sort(key=lambda x: x['_score'], reverse=True)
-            return X
+            return evaluate(cand, desc)
 
         L = []
         for conf in self.sample_param_space(bsize, q=qsize):
@@ -168,8 +238,9 @@ class ParameterSelection:
 
 
 class Wrapper(object):
-    def __init__(self, X, y, score, n_folds, cls, seed=0, pool=None):
+    def __init__(self, X, y, score, n_folds, cls, seed=0, pool=None, dedup=False, Cs=None):
         self.n_folds = n_folds
+        self.Cs = Cs
         self.score = score
         self.X = X
         self.le = le = preprocessing.LabelEncoder().fit(y)
@@ -177,36 +248,345 @@ class Wrapper(object):
         self.cls = cls
         self.pool = pool
         np.random.seed(seed)
+        # with dedup, the models are trained on the unique (text, label) pairs weighted by
+        # their number of copies; the folds split the unique pairs, keeping the copies together
+        self.train_X, self.train_y, self.sample_weight, self.inverse = X, self.y, None, None
+        if dedup:
+            self.train_X, self.train_y, self.sample_weight, self.inverse = collapse_duplicates(X, self.y)
+            self.train_y = np.array(self.train_y)
+        from b4msa.textmodel import NormalizedCache
+        # normalized texts reused by the configurations evaluated in this process, only the q-grams
+        # are computed for each one; the tasks of imap read them from a shared file instead
+        self.normalized = NormalizedCache()
         self.kfolds = [x for x in StratifiedKFold(n_splits=n_folds, shuffle=True,
-                                                  random_state=seed).split(np.zeros(self.y.shape[0]),
-                                                                           self.y)]
+                                                  random_state=seed).split(np.zeros(self.train_y.shape[0]),
+                                                                           self.train_y)]
+        # predictions of the folds of the configurations evaluated on a part of them, reused
+        # when they are promoted to more folds by successive halving (see cached_folds)
+        self.folds = {}
+        self.filename = None
+
+    # attributes stored by share instead of being pickled
+    SHARED = ['X', 'train_X', 'y', 'train_y', 'sample_weight', 'inverse', 'kfolds', 'normalized']
+
+    def share(self):
+        """Stores the dataset in a memory-mapped file; afterwards the Wrapper is pickled
+        without it, and each process reads it once (see attach_dataset)"""
+        fold = np.zeros(len(self.train_y), dtype=np.int64)
+        for k, (_, ts) in enumerate(self.kfolds):
+            fold[ts] = k
+        data, offsets = texts_to_arrays(self.train_X)
+        arrays = dict(train_X=data, train_X_offsets=offsets, y=self.y,
+                      train_y=np.asarray(self.train_y), fold=fold)
+        if self.sample_weight is not None:
+            arrays.update(sample_weight=self.sample_weight, inverse=self.inverse)
+        self.filename = share_arrays(arrays, dict(n_folds=len(self.kfolds)))
+        return self.filename
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['folds'] = {}
+        if state.get('filename') is not None:
+            for k in self.SHARED:
+                state.pop(k, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state.get('filename') is not None:
+            self.__dict__.update(attach_dataset(self.filename))
 
     def f(self, conf_code):
-        conf, code = conf_code
+        """Scores the configuration of the pair (conf, code); a third element, the budget,
+        limits the evaluation to the first folds (see ParameterSelection.search)"""
+        conf, code = conf_code[:2]
+        kfolds = self.get_kfolds(conf_code)
+        if self.Cs is not None:
+            return self.f_path(conf, kfolds)
+        entry, missing = self.cached_folds(conf, kfolds)
         st = time()
-        hy = self.cls.predict_kfold(self.X, self.y, self.n_folds,
-                                    textModel_params=conf,
-                                    kfolds=self.kfolds,
-                                    pool=self.pool,
-                                    use_tqdm=False)
-        self.compute_score(conf, hy)
-        conf['_time'] = (time() - st) / self.n_folds
+        if missing:
+            hy = self.cls.predict_kfold(self.train_X, self.train_y, self.n_folds,
+                                        textModel_params=conf,
+                                        kfolds=[kfolds[k] for k in missing],
+                                        pool=self.pool,
+                                        use_tqdm=False,
+                                        sample_weight=self.sample_weight,
+                                        normalized=self.normalized)
+            for k in missing:
+                ts = kfolds[k][1]
+                entry['folds'][k] = (ts, hy[ts])
+        entry['time'] += time() - st
+        return self.evaluate(conf, self.predictions(conf, entry, kfolds), entry['time'], kfolds)
+
+    def get_kfolds(self, conf_code):
+        if len(conf_code) > 2 and conf_code[2] is not None:
+            return self.kfolds[:conf_code[2]]
+        return self.kfolds
+
+    def fold_key(self, conf):
+        # the metadata, i.e., keys starting with underscore, changes between evaluations
+        return get_filename({k: v for k, v in conf.items() if k[0] != '_'})
+
+    def cached_folds(self, conf, kfolds):
+        """Predictions of the folds of the configuration computed in a previous evaluation,
+        with the time spent, and the positions in `kfolds` of the missing ones"""
+        entry = self.folds.pop(self.fold_key(conf), None) or dict(folds={}, time=0)
+        return entry, [k for k in range(len(kfolds)) if k not in entry['folds']]
+
+    def predictions(self, conf, entry, kfolds):
+        """Predictions of `kfolds` in `entry` (see cached_folds), as those of predict_kfold or
+        predict_kfold_path; the entry is kept when `kfolds` is a part of the folds"""
+        if len(kfolds) < len(self.kfolds):
+            self.folds[self.fold_key(conf)] = entry
+        if self.Cs is None:
+            hy = np.zeros(len(self.train_y), dtype=np.int)
+        else:
+            hy = {C: np.zeros(len(self.train_y), dtype=np.int) for C in self.Cs}
+        for k in range(len(kfolds)):
+            ts, _hy = entry['folds'][k]
+            if self.Cs is None:
+                hy[ts] = _hy
+                continue
+            for C, v in _hy.items():
+                hy[C][ts] = v
+        return hy
+
+    def f_path(self, conf, kfolds=None):
+        """Scores the configuration for each C in `Cs` on the same TF-IDF matrices, and
+        keeps the best C in the configuration, its scores, and the path in `_C_path`"""
+        st = time()
+        kfolds = self.kfolds if kfolds is None else kfolds
+        conf.pop('C', None)
+        entry, missing = self.cached_folds(conf, kfolds)
+        if missing:
+            path = self.cls.predict_kfold_path(self.train_X, self.train_y, self.Cs, self.n_folds,
+                                               textModel_params=conf,
+                                               kfolds=[kfolds[k] for k in missing],
+                                               pool=self.pool,
+                                               use_tqdm=False,
+                                               sample_weight=self.sample_weight,
+                                               normalized=self.normalized)
+            for k in missing:
+                ts = kfolds[k][1]
+                entry['folds'][k] = (ts, {C: v[ts] for C, v in path.items()})
+        entry['time'] += time() - st
+        return self.evaluate(conf, self.predictions(conf, entry, kfolds), entry['time'], kfolds)
+
+    def evaluate(self, conf, hy, elapsed, kfolds=None):
+        """Scores of the k-fold predictions `hy`; with `Cs`, `hy` maps each C to its predictions.
+        When `kfolds` is a part of the folds, only their test samples are scored."""
+        kfolds = self.kfolds if kfolds is None else kfolds
+        index = None
+        if len(kfolds) < len(self.kfolds):
+            mask = np.zeros(len(self.train_y), dtype=np.bool)
+            for _, ts in kfolds:
+                mask[ts] = True
+            index = np.where(mask if self.inverse is None else mask[self.inverse])[0]
+        if self.Cs is None:
+            if self.inverse is not None:
+                hy = hy[self.inverse]
+            self.compute_score(conf, hy, index)
+        else:
+            scores = {}
+            for C in self.Cs:
+                _hy = hy[C]
+                if self.inverse is not None:
+                    _hy = _hy[self.inverse]
+                scores[C] = {}
+                self.compute_score(scores[C], _hy, index)
+            best = max(self.Cs, key=lambda C: scores[C]['_score'])
+            conf.update(scores[best])
+            conf['C'] = best
+            conf['_C_path'] = {str(C): scores[C]['_score'] for C in self.Cs}
+        conf['_time'] = elapsed / len(kfolds)
         return conf
 
-    def compute_score(self, conf, hy):
-        RS = recall_score(self.y, hy, average=None)
-        conf['_all_f1'] = M = {str(self.le.inverse_transform([klass])[0]): f1 for klass, f1 in enumerate(f1_score(self.y, hy, average=None))}
+    def text_model(self, conf):
+        from b4msa.textmodel import TextModel
+        return TextModel([], **self.cls.split_params(conf)[0])
+
+    def normalize(self, args):
+        """Task of imap: normalized training texts from `start` to `end` with the configuration"""
+        conf, start, end = args
+        st = time()
+        t = self.text_model(conf)
+        return [t.normalize(x) for x in self.train_X[start:end]], time() - st
+
+    def tokenize(self, args):
+        """Task of imap: TokenCache of the training texts from `start` to `end` with the configuration;
+        the normalized texts are read from the file `filename` (see imap)"""
+        from b4msa.textmodel import TokenCache
+        conf, filename, start, end = args
+        st = time()
+        t = self.text_model(conf)
+        _, arrays = attach_arrays(filename)
+        texts = arrays_to_texts(arrays['texts'], arrays['texts_offsets'][start:end + 1])
+        cache = TokenCache([t.expand(x) for x in texts], hash_size=t.hash_size)
+        return cache, time() - st
+
+    def fold(self, args):
+        """Task of imap: predictions of the k-th fold with the configuration"""
+        data, conf, k = args
+        st = time()
+        tr, ts = self.kfolds[k]
+        if self.Cs is None:
+            res = self.cls.train_predict_pool((data, tr, ts, conf))
+        else:
+            res = self.cls.train_predict_path_pool((data, tr, ts, conf, self.Cs))
+        return res, time() - st
+
+    def imap(self, cand, pool, max_configs=4, chunks=4):
+        """Scores the configurations `cand`, a list of (conf, code) or (conf, code, budget) as
+        in f, with tasks submitted to `pool`: the training texts of a configuration are
+        tokenized in `chunks` parts, merged into a shared file, and each fold is a task; so
+        the processes are busy regardless of the number of folds and configurations.
+        The texts are normalized once for each normalize_key of TextModel, also in `chunks`
+        tasks, and shared through a file with the configurations having that key, which are
+        evaluated one after the other. A configuration is yielded as soon as its folds are
+        complete; at most `max_configs` of them are tokenized and kept in memory. Only the
+        folds without predictions from a previous evaluation are run (see cached_folds)."""
+        from b4msa.textmodel import TokenCache
+        cand = list(cand)
+        todo = []
+        for conf_code in cand:
+            conf = conf_code[0]
+            if self.Cs is not None:
+                conf.pop('C', None)
+            kfolds = self.get_kfolds(conf_code)
+            entry, missing = self.cached_folds(conf, kfolds)
+            if missing:
+                todo.append((conf_code, self.text_model(conf).normalize_key(), entry, missing))
+                continue
+
+            yield self.evaluate(conf, self.predictions(conf, entry, kfolds), entry['time'], kfolds)
+
+        keys = [x[1] for x in todo]
+        first = {}
+        for key in keys:
+            first.setdefault(key, len(first))
+        todo.sort(key=lambda x: first[x[1]], reverse=True)
+        n = len(self.train_X)
+        limits = [n * i // chunks for i in range(chunks + 1)]
+        configs = {}
+        # normalized texts of each key: the file, its parts, and the configurations using it
+        normalized = {}
+        for key in keys:
+            normalized.setdefault(key, dict(filename=None, parts=[None] * chunks, parts_left=chunks,
+                                            waiting=[], uses=0))['uses'] += 1
+        pending = []
+
+        def submit(code):
+            c = configs[code]
+            filename = normalized[c['key']]['filename']
+            for i in range(chunks):
+                args = (self, 'tokenize', (c['conf'], filename, limits[i], limits[i + 1]))
+                pending.append((pool.apply_async(run_task, (args,)), code, 'tokenize', i))
+
+        try:
+            while todo or pending:
+                while todo and len(configs) < max_configs:
+                    conf_code, key, entry, missing = todo.pop()
+                    conf, code = conf_code[:2]
+                    configs[code] = dict(conf=conf, key=key, data=None, entry=entry, missing=missing,
+                                         kfolds=self.get_kfolds(conf_code), left=len(missing), time=0,
+                                         parts=[None] * chunks, parts_left=chunks)
+                    e = normalized[key]
+                    if e['filename'] is not None:
+                        submit(code)
+                        continue
+
+                    e['waiting'].append(code)
+                    if len(e['waiting']) == 1:
+                        for i in range(chunks):
+                            args = (self, 'normalize', (conf, limits[i], limits[i + 1]))
+                            pending.append((pool.apply_async(run_task, (args,)), code, 'normalize', i))
+
+                ready = [x for x in pending if x[0].ready()]
+                if len(ready) == 0:
+                    pending[0][0].wait(0.01)
+                    continue
+
+                for x in ready:
+                    pending.remove(x)
+                    r, code, task, k = x
+                    c = configs[code]
+                    res, elapsed = r.get()
+                    c['time'] += elapsed
+                    if task == 'normalize':
+                        e = normalized[c['key']]
+                        e['parts'][k] = res
+                        e['parts_left'] -= 1
+                        if e['parts_left'] > 0:
+                            continue
+
+                        data, offsets = texts_to_arrays([text for part in e['parts'] for text in part])
+                        e['parts'] = None
+                        e['filename'] = share_arrays(dict(texts=data, texts_offsets=offsets))
+                        for w in e['waiting']:
+                            submit(w)
+                        e['waiting'] = []
+                        continue
+
+                    if task == 'tokenize':
+                        c['parts'][k] = res
+                        c['parts_left'] -= 1
+                        if c['parts_left'] > 0:
+                            continue
+
+                        st = time()
+                        cache = TokenCache.merge(c['parts'])
+                        c['parts'] = None
+                        e = normalized[c['key']]
+                        e['uses'] -= 1
+                        if e['uses'] == 0:
+                            os.unlink(e['filename'])
+                            del normalized[c['key']]
+                        c['data'] = self.cls.share_data(cache, self.train_y, self.sample_weight)
+                        c['time'] += time() - st
+                        for k in c['missing']:
+                            args = (self, 'fold', (c['data'], c['conf'], k))
+                            pending.append((pool.apply_async(run_task, (args,)), code, 'fold', k))
+                        continue
+
+                    entry = c['entry']
+                    entry['folds'][k] = res
+                    c['left'] -= 1
+                    if c['left'] == 0:
+                        del configs[code]
+                        os.unlink(c['data'])
+                        entry['time'] += c['time']
+                        yield self.evaluate(c['conf'], self.predictions(c['conf'], entry, c['kfolds']),
+                                            entry['time'], c['kfolds'])
+        finally:
+            for c in configs.values():
+                if c['data'] is not None:
+                    os.unlink(c['data'])
+            for e in normalized.values():
+                if e['filename'] is not None:
+                    os.unlink(e['filename'])
+
+    def compute_score(self, conf, hy, index=None):
+        y = self.y
+        if index is not None:
+            # partial evaluation, see evaluate
+            y, hy = y[index], np.asarray(hy)[index]
+        # all the classes, including those missing in a part of the folds
+        labels = np.arange(len(self.le.classes_))
+        RS = recall_score(y, hy, average=None, labels=labels)
+        conf['_all_f1'] = M = {str(self.le.inverse_transform([klass])[0]): f1 for klass, f1 in enumerate(f1_score(y, hy, average=None, labels=labels))}
         conf['_all_recall'] = {str(self.le.inverse_transform([klass])[0]): f1 for klass, f1 in enumerate(RS)}
-        conf['_all_precision'] = N = {str(self.le.inverse_transform([klass])[0]): f1 for klass, f1 in enumerate(precision_score(self.y, hy, average=None))}
+        conf['_all_precision'] = N = {str(self.le.inverse_transform([klass])[0]): f1 for klass, f1 in enumerate(precision_score(y, hy, average=None, labels=labels))}
         conf['_macrorecall'] = np.mean(RS)
         if len(self.le.classes_) == 2:
             conf['_macrof1'] = np.mean(np.array([v for v in conf['_all_f1'].values()]))
-            conf['_weightedf1'] = conf['_microf1'] = f1_score(self.y, hy, average='binary')
+            conf['_weightedf1'] = conf['_microf1'] = f1_score(y, hy, average='binary', labels=labels)
         else:
-            conf['_macrof1'] = f1_score(self.y, hy, average='macro')
-            conf['_microf1'] = f1_score(self.y, hy, average='micro')
-            conf['_weightedf1'] = f1_score(self.y, hy, average='weighted')
-        conf['_accuracy'] = accuracy_score(self.y, hy)
+            conf['_macrof1'] = f1_score(y, hy, average='macro', labels=labels)
+            conf['_microf1'] = f1_score(y, hy, average='micro', labels=labels)
+            conf['_weightedf1'] = f1_score(y, hy, average='weighted', labels=labels)
+        conf['_accuracy'] = accuracy_score(y, hy)
         if self.score.startswith('avgf1:'):
             _, k1, k2 = self.score.split(':')
             conf['_' + self.score] = (M[k1] + M[k2]) / 2
@@ -218,6 +598,32 @@ class Wrapper(object):
         conf['_score'] = conf['_' + self.score]
 
 
+def run_task(args):
+    """Calls a method of the Wrapper in a pool process (bound methods cannot be pickled in Python 2)"""
+    wrapper, method, arg = args
+    return getattr(wrapper, method)(arg)
+
+
+_DATASETS = {}
+
+
+def attach_dataset(filename):
+    """Dataset of a Wrapper stored by Wrapper.share; it is the initializer of the pool
+    processes, so each one maps the file and decodes the texts once"""
+    if filename not in _DATASETS:
+        from b4msa.textmodel import NormalizedCache
+        _DATASETS.clear()
+        header, arrays = attach_arrays(filename)
+        fold = np.asarray(arrays['fold'])
+        _DATASETS[filename] = dict(train_X=arrays_to_texts(arrays['train_X'], arrays['train_X_offsets']),
+                                   y=arrays['y'], train_y=arrays['train_y'],
+                                   sample_weight=arrays.get('sample_weight'), inverse=arrays.get('inverse'),
+                                   kfolds=[(np.where(fold != k)[0], np.where(fold == k)[0])
+                                           for k in range(header['n_folds'])],
+                                   normalized=NormalizedCache())
+    return _DATASETS[filename]
+
+
 def get_filename(kwargs, basename=None):
     L = []
     if basename:
@@ -46,6 +46,347 @@ def test_SVC_predict():
     assert y == 'POS'
 
 
+def test_SVC_hashing():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    t = TextModel(X, hash_size=4096)
+    c = SVC(t)
+    c.fit([t[x] for x in X], y)
+    assert c.num_terms == 4096
+    assert c.predict_text('Excelente dia b4msa') in ['POS', 'NEU', 'NEG']
+
+
+def test_SVC_update():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    half = len(X) // 2
+    t = TextModel(X[:half])
+    c = SVC(t).fit([t[x] for x in X[:half]], y[:half])
+    num_terms = c.num_terms
+    t.update(X[half:])
+    assert len(t.dictionary) > num_terms
+    hy = c.predict([t[x] for x in X[half:]])
+    assert len(hy) == len(X) - half
+
+
+def test_SVC_fold():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    binary = [k for k, v in enumerate(y) if v != 'NEU']
+    for X, y in [(X, y), ([X[k] for k in binary], [y[k] for k in binary])]:
+        for compact in [False, True]:
+            t = TextModel(X, token_list=[-1, 3], compact=compact)
+            c = SVC(t).fit([t[x] for x in X], y)
+            f = c.fold()
+            df = c.decision_function([t[x] for x in X])
+            assert np.fabs(f.decision_function(X) - df).max() < 1e-9
+            assert (f.predict(X) == c.predict([t[x] for x in X])).all()
+            assert f.predict_text(X[0]) == c.predict_text(X[0])
+
+
+def test_FoldedSVC_save():
+    from b4msa.classifier import SVC, FoldedSVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import tempfile
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    output = tempfile.mktemp()
+    for params in [dict(token_list=[-1, 3]), dict(token_list=[3], hash_size=1024)]:
+        t = TextModel(X, **params)
+        f = SVC(t).fit([t[x] for x in X], y).fold()
+        f.save(output)
+        g = FoldedSVC.load(output)
+        assert g.model.token_list == [-1, 3] or g.model.hash_size == 1024
+        assert np.fabs(f.decision_function(X) - g.decision_function(X)).max() < 1e-12
+        assert (f.predict(X) == g.predict(X)).all()
+    os.unlink(output)
+
+
+def test_FoldedSVC_mmap():
+    from b4msa.classifier import SVC, FoldedSVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import tempfile
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    output = tempfile.mktemp()
+    t = TextModel(X, token_list=[-1, 3])
+    f = SVC(t).fit([t[x] for x in X], y).fold()
+    f.save(output)
+    g = FoldedSVC.load(output)
+    h = FoldedSVC.load(output, mmap_mode=None)
+    assert isinstance(g.weights, np.memmap) and isinstance(g.model.dictionary.tokens.data, np.memmap)
+    assert not isinstance(h.weights, np.memmap)
+    assert (g.decision_function(X) == h.decision_function(X)).all()
+    g.model.update(X)
+    assert g.model.dictionary.num_docs == 2 * len(X)
+    os.unlink(output)
+
+
+def test_FoldedSVC_quantize():
+    from b4msa.classifier import SVC, FoldedSVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import tempfile
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    output = tempfile.mktemp()
+    t = TextModel(X, token_list=[-1, 3])
+    f = SVC(t).fit([t[x] for x in X], y).fold()
+    hy = f.decision_function(X)
+    for dtype, error in [('float16', 1e-2), ('int8', 5e-2)]:
+        q = f.quantize(dtype)
+        assert q.weights.dtype == np.dtype(dtype)
+        assert np.fabs(q.decision_function(X) - hy).max() < error
+        assert q.idfs.dtype == np.float32
+        assert np.all(q.predict(X) == f.predict(X))
+        q.save(output)
+        g = FoldedSVC.load(output)
+        assert g.weights.dtype == np.dtype(dtype)
+        assert (g.decision_function(X) == q.decision_function(X)).all()
+    os.unlink(output)
+
+
+def test_SVC_select():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    t = TextModel(X, token_list=[-1, 3])
+    for score in ['chi2', 'mutual_info']:
+        c = SVC(t, select_k=20, select_score=score).fit([t[x] for x in X], y)
+        assert c.selected.shape[0] == 20
+        assert c.svc.coef_.shape == (3, 20)
+        f = c.fold()
+        assert (f.idfs > 0).sum() <= 20
+        assert np.fabs(f.decision_function(X) - c.decision_function([t[x] for x in X])).max() < 1e-9
+    c = SVC(t, select_k=len(t.dictionary)).fit([t[x] for x in X], y)
+    assert c.selected is None
+    textmodel, svc = SVC.split_params(dict(token_list=[-1], select_k=10))
+    assert textmodel == dict(token_list=[-1]) and svc == dict(select_k=10)
+    hy = SVC.predict_kfold(X, y, n_folds=2, textModel_params=dict(token_list=[-1, 3], select_k=10))
+    assert len(hy) == len(y)
+
+
+def test_FoldedSVC_prune():
+    from b4msa.classifier import SVC, FoldedSVC
+    from b4msa.textmodel import TextModel, Vocabulary
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import tempfile
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    t = TextModel(X, token_list=[-1, 3])
+    f = SVC(t, select_k=20).fit([t[x] for x in X], y).fold()
+    p = f.prune()
+    assert p.num_terms <= 20 and len(p.model.dictionary) == p.num_terms
+    assert p.nbytes < f.nbytes
+    assert len(t.dictionary) == f.num_terms
+    assert isinstance(f.model.model, Vocabulary) and not isinstance(t.model, Vocabulary)
+    assert np.fabs(p.decision_function(X) - f.decision_function(X)).max() < 1e-12
+    assert np.all(p.predict(X) == f.predict(X))
+    output = tempfile.mktemp()
+    p.save(output)
+    assert np.all(FoldedSVC.load(output).decision_function(X) == p.decision_function(X))
+    os.unlink(output)
+    f = SVC(t).fit([t[x] for x in X], y).fold()
+    assert f.prune().num_terms <= f.num_terms
+    assert f.prune(exact=False).num_terms <= f.prune().num_terms
+    t = TextModel(X, token_list=[3], hash_size=1024)
+    f = SVC(t).fit([t[x] for x in X], y).fold()
+    try:
+        f.prune()
+        assert False
+    except ValueError:
+        pass
+
+
+def test_SVC_dedup():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels, collapse_duplicates
+    from b4msa.params import Wrapper
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    X2, y2 = X + X[:5] + X[:5], y + y[:5] + y[:5]
+    Xu, yu, w, inverse = collapse_duplicates(X2, y2)
+    assert Xu == X and w.sum() == len(X2)
+    t = TextModel(Xu)
+    c1 = SVC(t).fit([t[x] for x in Xu], yu, sample_weight=w)
+    c2 = SVC(t).fit([t[x] for x in X2], y2)
+    assert np.fabs(c1.svc.coef_ - c2.svc.coef_).max() < 1e-3
+    hy = SVC.predict_kfold(X2, y2, n_folds=2, dedup=True)
+    assert len(hy) == len(y2)
+    assert np.all(hy[inverse == 0] == hy[0])
+    for dedup in [True, 'near']:
+        c = SVC.fit_from_file(fname, dict(token_list=[-1]), dedup=dedup)
+        assert len(c.predict([c.model[x] for x in X])) == len(X)
+    # with near-duplicates, the texts are tokenized once and the model is the same as
+    # the one trained on the collapsed texts
+    calls = []
+    tokenize = TextModel.tokenize
+    TextModel.tokenize = lambda self, text: calls.append(text) or tokenize(self, text)
+    try:
+        c = SVC.fit_from_file(fname, dict(token_list=[-1]), dedup='near')
+    finally:
+        TextModel.tokenize = tokenize
+    assert len(calls) == len(X)
+    t = TextModel(X, token_list=[-1])
+    d = SVC(t).fit([t[x] for x in X], y)
+    assert np.fabs(c.decision_function([c.model[x] for x in X]) - d.decision_function([t[x] for x in X])).max() < 1e-3
+    f = Wrapper(X2, y2, 'macrof1', 2, SVC, dedup=True)
+    for tr, ts in f.kfolds:
+        assert len(tr) + len(ts) == len(Xu)
+    conf = f.f((dict(token_list=[-1]), None))
+    assert 0 <= conf['_score'] <= 1
+
+
+def test_SVC_backend():
+    from b4msa.classifier import SVC, BACKENDS
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    t = TextModel(X)
+    for backend in BACKENDS:
+        for n_jobs in [None, 2]:
+            c = SVC(t, backend=backend, n_jobs=n_jobs).fit([t[x] for x in X], y)
+            hy = c.decision_function([t[x] for x in X])
+            assert hy.shape == (len(X), 3)
+            assert np.fabs(c.fold().decision_function(X) - hy).max() < 1e-9
+    hy = SVC.predict_kfold(X, y, n_folds=2, textModel_params=dict(token_list=[-1], backend='sgd'))
+    assert len(hy) == len(y)
+
+
+def test_predict_kfold_path():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    from b4msa.params import Wrapper
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    t = TextModel(X)
+    c1 = SVC(t, C=0.1, backend='liblinear_primal').fit([t[x] for x in X], y)
+    c2 = SVC(t, backend='liblinear_primal').fit([t[x] for x in X], y)
+    assert np.fabs(c1.svc.coef_).sum() < np.fabs(c2.svc.coef_).sum()
+    Cs = [0.1, 1, 10]
+    for backend in ['liblinear_primal', 'sgd', 'saga']:
+        params = dict(token_list=[-1], backend=backend)
+        path = SVC.predict_kfold_path(X, y, Cs, n_folds=2, textModel_params=params)
+        assert sorted(path.keys()) == Cs
+        for C in Cs:
+            assert len(path[C]) == len(y)
+    params = dict(token_list=[-1], backend='liblinear_primal')
+    path = SVC.predict_kfold_path(X, y, Cs, n_folds=2, textModel_params=params)
+    hy = SVC.predict_kfold(X, y, n_folds=2, textModel_params=dict(params, C=10))
+    assert np.all(path[10] == hy)
+    f = Wrapper(X, y, 'macrof1', 2, SVC, Cs=Cs)
+    conf = f.f((dict(token_list=[-1]), None))
+    assert conf['C'] in Cs
+    assert conf['_score'] == max(conf['_C_path'].values())
+
+
+def test_predict_iter():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels, tweet_iterator
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    t = TextModel(X)
+    c = SVC(t).fit([t[x] for x in X], y)
+    for m in [c, c.fold()]:
+        hy, qv = m.predict_q_voc_ratio(X)
+        assert np.all(hy == c.predict([t[x] for x in X]))
+        assert np.all(qv == t.q_voc_ratio(X))
+        res = list(m.predict_iter((tw['text'] for tw in tweet_iterator(fname)), chunk_size=7))
+        assert len(res) == len(X)
+        assert np.all(np.array([h for h, _ in res]) == hy)
+        assert np.all(np.array([r for _, r in res]) == qv)
+        res = list(m.predict_iter(iter(X), chunk_size=7, decision_function=True))
+        df = m.predict_q_voc_ratio(X, decision_function=True)[0]
+        assert np.fabs(np.array([h for h, _ in res]) - df).max() < 1e-9
+
+
+def test_SVC_n_jobs():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    t = TextModel(X)
+    X = [t[x] for x in X]
+    for labels in [y, ['POS' if x == 'POS' else 'NO' for x in y]]:
+        c1 = SVC(t).fit(X, labels)
+        c2 = SVC(t, n_jobs=2).fit(X, labels)
+        assert np.all(c1.svc.coef_ == c2.svc.coef_)
+        assert np.all(c1.svc.intercept_ == c2.svc.intercept_)
+        assert np.all(c1.decision_function(X) == c2.decision_function(X))
+        assert np.all(c1.predict(X) == c2.predict(X))
+        assert c1.svc.coef_.shape[0] == (1 if len(set(labels)) == 2 else 3)
+
+
+def test_OnlineSVC():
+    from b4msa.classifier import OnlineSVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    for t in [TextModel([], token_list=[-1, 3]), TextModel([], token_list=[3], hash_size=1024)]:
+        c = OnlineSVC(t).fit_file(fname, batch_size=3)
+        assert t.model.num_docs == len(X)
+        assert c.num_terms == len(t.dictionary)
+        assert c.svc.coef_.shape == (3, c.num_terms)
+        for x in c.predict([t[x] for x in X]):
+            assert x in ['POS', 'NEU', 'NEG']
+    t = TextModel(X[:4], token_list=[-1, 3])
+    c = OnlineSVC(t, classes=y)
+    c.partial_fit([t[x] for x in X[:4]], y[:4])
+    num_terms = c.num_terms
+    t.update(X[4:])
+    c.partial_fit([t[x] for x in X[4:]], y[4:])
+    assert c.num_terms > num_terms
+    assert np.fabs(c.fold().decision_function(X) - c.decision_function([t[x] for x in X])).max() < 1e-9
+    c1 = OnlineSVC(TextModel([], token_list=[-1, 3])).fit_file(fname, batch_size=3)
+    c2 = OnlineSVC(TextModel([], token_list=[-1, 3])).fit_file(fname, batch_size=3)
+    assert np.all(c1.svc.coef_ == c2.svc.coef_)
+
+
 def test_kfold():
     import os
     from b4msa.classifier import SVC
@@ -71,6 +412,54 @@ def test_kfold_pool():
     for x in hy:
         assert x in ['POS', 'NEU', 'NEG']
     pool.close()
-    
+
+
+def test_kfold_pool_tokenize():
+    import os
+    import numpy as np
+    from b4msa.classifier import SVC
+    from b4msa.utils import read_data_labels
+    from multiprocessing.pool import ThreadPool
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    params = dict(token_list=[-1, 3])
+    cache = SVC.token_cache(X, params)
+    pool = ThreadPool(2)
+    merged = SVC.token_cache_pool(X, params, pool, 3)
+    assert merged.tokens.tolist() == cache.tokens.tolist() and np.all(merged.ids == cache.ids)
+    hy = SVC.predict_kfold(X, y, n_folds=3, textModel_params=params, pool=pool, use_tqdm=False)
+    assert np.all(hy == SVC.predict_kfold(X, y, n_folds=3, textModel_params=params, use_tqdm=False))
+    path = SVC.predict_kfold_path(X, y, [0.1, 1], n_folds=3, textModel_params=params, pool=pool, use_tqdm=False)
+    for C, v in SVC.predict_kfold_path(X, y, [0.1, 1], n_folds=3, textModel_params=params, use_tqdm=False).items():
+        assert np.all(path[C] == v)
+    pool.close()
+
+
+def test_baseline_pickle():
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import pickle
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    X, y = read_data_labels(fname)
+    t = TextModel(X)
+    c = SVC(t).fit([t[x] for x in X], y)
+    hy = c.predict_text(X[0])
+    # attributes of the models pickled by the first versions
+    for k in ['min_df', 'max_df', 'max_features', 'hash_size', 'sketch_width', 'sketch_depth']:
+        del t.__dict__[k]
+    for k in list(c.__dict__.keys()):
+        if k not in ['svc', 'model', 'num_terms', 'le']:
+            del c.__dict__[k]
+    c = pickle.loads(pickle.dumps(c))
+    assert c.predict_text(X[0]) == hy
+    hy, ratio = c.predict_q_voc_ratio(X[:3])
+    assert len(hy) == 3 and np.all(ratio > 0)
+    assert c.model.get_params()['hash_size'] is None
+    str(c.model)
+
+
 if __name__ == '__main__':
-	test_SVC_predict_from_file()
\ No newline at end of file
+	test_SVC_predict_from_file()
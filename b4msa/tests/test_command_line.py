@@ -101,6 +101,39 @@ def test_train():
     os.unlink(c.get_output())
         
 
+def test_train_prune():
+    from b4msa.command_line import CommandLineTrain
+    from b4msa.classifier import FoldedSVC
+    import os
+    import sys
+    import json
+    import tempfile
+    params = tempfile.mktemp()
+    with open(params, 'w') as fpt:
+        fpt.write(json.dumps([dict(token_list=[-1])]))
+    output = tempfile.mktemp()
+    fname = os.path.dirname(__file__) + '/text.json'
+    c = CommandLineTrain()
+    sys.argv = ['b4msa', '-m', params, fname, '-o', output, '--prune']
+    try:
+        c.main()
+        assert False
+    except SystemExit:
+        pass
+    assert not os.path.isfile(output)
+    c = CommandLineTrain()
+    sys.argv = ['b4msa', '-m', params, fname, '-o', output, '--prune', '-b']
+    c.main()
+    num_terms = FoldedSVC.load(output).num_terms
+    assert num_terms > 0
+    c = CommandLineTrain()
+    sys.argv = ['b4msa', '-m', params, fname, '-o', output, '-b', '--prune', 'approx']
+    c.main()
+    assert 0 < FoldedSVC.load(output).num_terms <= num_terms
+    os.unlink(params)
+    os.unlink(output)
+
+
 def test_train2():
     from b4msa.command_line import CommandLine, train
     import os
@@ -169,6 +202,58 @@ def test_decision_function():
     assert len(d) == len([x for x in d if 'decision_function' in x])
 
 
+def test_binary():
+    from b4msa.command_line import params, train, test
+    from b4msa.utils import tweet_iterator, is_array_file
+    import os
+    import sys
+    import tempfile
+    output = tempfile.mktemp()
+    fname = os.path.dirname(__file__) + '/text.json'
+    sys.argv = ['b4msa', '-o', output, '-k', '2', fname, '-s', '2']
+    params()
+    model = tempfile.mktemp()
+    sys.argv = ['b4msa', '-m', output, fname, '-o', model]
+    train()
+    binary = tempfile.mktemp()
+    sys.argv = ['b4msa', '-b', '-m', output, fname, '-o', binary]
+    train()
+    assert is_array_file(binary) and not is_array_file(model)
+    output2 = tempfile.mktemp()
+    output3 = tempfile.mktemp()
+    for m, o in [(model, output2), (binary, output3)]:
+        sys.argv = ['b4msa', '-m', m, fname, '-o', o, '--decision-function']
+        test()
+    for a, b in zip(tweet_iterator(output2), tweet_iterator(output3)):
+        assert a['q_voc_ratio'] == b['q_voc_ratio']
+        assert len(a['decision_function']) == len(b['decision_function'])
+    for f in [output, model, binary, output2, output3]:
+        os.unlink(f)
+
+
+def test_quantize():
+    from b4msa.command_line import params, train, quantize
+    from b4msa.classifier import FoldedSVC
+    import os
+    import sys
+    import tempfile
+    output = tempfile.mktemp()
+    fname = os.path.dirname(__file__) + '/text.json'
+    sys.argv = ['b4msa', '-o', output, '-k', '2', fname, '-s', '2']
+    params()
+    model = tempfile.mktemp()
+    sys.argv = ['b4msa', '-m', output, fname, '-o', model]
+    train()
+    output2 = tempfile.mktemp()
+    sys.argv = ['b4msa', '-m', model, fname, '-o', output2, '--dtype', 'int8']
+    report = quantize()
+    assert report['agreement'] > 0.5
+    assert report['accuracy_delta'] == report['quantized_accuracy'] - report['accuracy']
+    assert FoldedSVC.load(output2).scales is not None
+    for f in [output, model, output2]:
+        os.unlink(f)
+
+
 def test_score():
     from b4msa.command_line import params
     import os
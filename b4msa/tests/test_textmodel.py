@@ -62,6 +62,242 @@ def test_params():
         ins = TextModel(text, **args)
         assert isinstance(ins[text[0]], list)
 
+def test_pruning():
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    full = TextModel(text, token_list=[3])
+    model = TextModel(text, token_list=[3], min_df=2)
+    assert len(model.dictionary) < len(full.dictionary)
+    assert min(model.dictionary.dfs.values()) >= 2
+    model = TextModel(text, token_list=[3], max_features=100)
+    assert len(model.dictionary) == 100
+    assert isinstance(model[text[0]], list)
+
+
+def test_sketch():
+    from b4msa.textmodel import TextModel, CountMinSketch
+    from b4msa.utils import read_data
+    import os
+    sketch = CountMinSketch(width=64, depth=3)
+    sketch.add(['a', 'b', 'a'])
+    sketch.add(['a'])
+    est = sketch.estimate(['a', 'b', 'c'])
+    assert est[0] >= 3 and est[1] >= 1
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    exact = TextModel(text, token_list=[3], min_df=2)
+    model = TextModel(text, token_list=[3], min_df=2, sketch_width=2 ** 16)
+    assert model.dictionary.token2id == exact.dictionary.token2id
+    assert model.dictionary.dfs == exact.dictionary.dfs
+    for a, b in zip(model[text[0]], exact[text[0]]):
+        assert a[0] == b[0] and abs(a[1] - b[1]) < 1e-9
+
+
+def test_token_cache():
+    from b4msa.textmodel import TextModel, TokenCache, to_utf8
+    from b4msa.utils import read_data
+    from gensim.matutils import corpus2csc
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    tr, ts = np.arange(2, len(text)), np.arange(2)
+    for params in [dict(token_list=[-1, 3]), dict(token_list=[2, 3], min_df=2),
+                   dict(token_list=[3], hash_size=128)]:
+        cache = TokenCache.from_texts(TextModel([], **params), text)
+        model = TextModel([text[i] for i in tr], **params).compact()
+        vocabulary, newids = cache.vocabulary(ts, min_df=model.min_df)
+        assert len(vocabulary) == len(model.dictionary)
+        assert vocabulary.num_docs == len(tr)
+        X = cache.tfidf(vocabulary, newids, np.arange(len(text)))
+        for i, x in enumerate(text):
+            # the ids of both vocabularies differ, the weights of each token do not
+            tokens = model.tokenize(x)
+            a = X[i, vocabulary.lookup(tokens)].toarray()[0]
+            b = corpus2csc([model[x]], num_terms=len(model.dictionary)).T[0, model.lookup(tokens)].toarray()[0]
+            a[vocabulary.lookup(tokens) < 0] = 0
+            b[model.lookup(tokens) < 0] = 0
+            assert np.fabs(a - b).max() < 1e-12
+    # a corpus tokenized in parts
+    for params in [dict(token_list=[-1, 3]), dict(token_list=[3], hash_size=128)]:
+        t = TextModel([], **params)
+        cache = TokenCache.from_texts(t, text)
+        merged = TokenCache.merge([TokenCache.from_texts(t, text[a:b]) for a, b in [(0, 3), (3, 3), (3, 10)]])
+        assert merged.num_docs == cache.num_docs and merged.size == cache.size
+        for k in ['doc', 'ids', 'counts', 'dfs']:
+            assert np.all(getattr(merged, k) == getattr(cache, k))
+        if cache.tokens is not None:
+            assert merged.tokens.tolist() == cache.tokens.tolist()
+            assert cache.tokens.tolist() == sorted(set([to_utf8(x) for d in text for x in t.tokenize(d)]))
+    # the ties of max_features are broken as in TextModel
+    tr, ts = np.arange(0, len(text), 2), np.arange(1, len(text), 2)
+    for max_features in [5, 20, 50]:
+        params = dict(token_list=[2, 3], max_features=max_features)
+        cache = TokenCache.from_texts(TextModel([], **params), text)
+        model = TextModel([text[i] for i in tr], **params)
+        vocabulary, _ = cache.vocabulary(ts, max_features=max_features)
+        assert sorted(vocabulary.tokens.tolist()) == sorted([to_utf8(t) for t in model.dictionary.token2id])
+
+
+def test_normalized_cache():
+    from b4msa.textmodel import TextModel, TokenCache, NormalizedCache
+    from b4msa.utils import read_data
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    normalized = NormalizedCache(max_entries=2)
+    a, b = TextModel([], token_list=[-1]), TextModel([], token_list=[2, 3], lc=False)
+    assert a.normalize_key() == b.normalize_key()
+    assert normalized.get(a, text) is normalized.get(b, text)
+    assert len(normalized.entries) == 1
+    for t in [a, b]:
+        cache = TokenCache.from_texts(t, text, normalized=normalized)
+        expected = TokenCache.from_texts(t, text)
+        assert cache.tokens.tolist() == expected.tokens.tolist() and np.all(cache.counts == expected.counts)
+        assert [t.expand(t.normalize(x)) for x in text] == [t.tokenize(x) for x in text]
+    c = TextModel([], token_list=[-1], strip_diac=False)
+    assert c.normalize_key() != a.normalize_key()
+    normalized.get(c, text)
+    normalized.get(a, text[:3])
+    assert len(normalized.entries) == 2
+
+
+def test_minhash():
+    from b4msa.textmodel import TextModel, MinHash, TokenCache
+    from b4msa.utils import read_data
+    import numpy as np
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    base = u'gran oferta de celulares y computadoras solo hoy en la tienda del centro'
+    X = [base + u' http://t.co/abc', base + u' http://t.co/xyz', base + u' @usuario'] + text
+    y = ['NEG', 'NEG', 'POS'] + ['NEG'] * len(text)
+    model = TextModel([], token_list=[3])
+    docs = [model.tokenize(x) for x in X]
+    minhash = MinHash()
+    clusters = minhash.clusters(docs)
+    assert clusters[0] == clusters[1] == clusters[2] == 0
+    assert len(set(clusters[3:])) == len(text)
+    Xu, yu, w, inverse = minhash.collapse(docs, X, y)
+    assert len(Xu) == len(text) + 2
+    assert Xu[0] == X[0] and w[0] == 2 and w[1] == 1
+    assert inverse[:3].tolist() == [0, 0, 1]
+    # the signatures computed from the tokens of a TokenCache are the same
+    signatures = minhash.cache_signatures(TokenCache.from_texts(model, X + [u'']))
+    assert (signatures == np.array([minhash.signature(d) for d in docs + [[]]])).all()
+    assert minhash.collapse(None, X, y, signatures=signatures[:-1])[3].tolist() == inverse.tolist()
+
+
+def test_update():
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    half = len(text) // 2
+    model = TextModel(text[:half], token_list=[3])
+    token2id = dict(model.dictionary.token2id)
+    model.update(text[half:])
+    assert model.dictionary.num_docs == len(text)
+    assert len(model.dictionary) > len(token2id)
+    for k, v in token2id.items():
+        assert model.dictionary.token2id[k] == v
+    full = TextModel(text, token_list=[3])
+    for k, v in full.dictionary.token2id.items():
+        _k = model.dictionary.token2id[k]
+        assert model.dictionary.dfs[_k] == full.dictionary.dfs[v]
+        assert abs(model.model.idfs[_k] - full.model.idfs[v]) < 1e-9
+    model = TextModel(text[:half], token_list=[3], hash_size=1024)
+    model.update(text[half:])
+    full = TextModel(text, token_list=[3], hash_size=1024)
+    assert model.model.num_docs == len(text)
+    assert model.model.idfs == full.model.idfs
+
+
+def test_compact():
+    from b4msa.textmodel import TextModel, Vocabulary
+    from b4msa.utils import read_data
+    import os
+    import pickle
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    half = len(text) // 2
+    for params in [dict(token_list=[-1, 3]), dict(token_list=[3], hash_size=1024)]:
+        model = TextModel(text[:half], **params)
+        compact = pickle.loads(pickle.dumps(TextModel(text[:half], compact=True, **params)))
+        assert isinstance(compact.model, Vocabulary)
+        assert len(compact.dictionary) == len(model.dictionary)
+        model.update(text[half:])
+        compact.update(text[half:])
+        for t in text[:10] + ['unknown tokens only zzzqqq']:
+            a = model[t]
+            b = compact[t]
+            assert [k for k, v in a] == [k for k, v in b]
+            for (_, v), (_, w) in zip(a, b):
+                assert abs(v - w) < 1e-9
+
+
+def test_string_table():
+    from b4msa.textmodel import StringTable
+    import numpy as np
+    import pickle
+    words = sorted([b'a', b'ab', b'abcdefgh', b'abcdefghi', b'abcdefghj', b'b', b'\xc3\xb1'])
+    table = StringTable.from_sorted(words)
+    assert len(table) == len(words) and table.tolist() == words
+    # each string takes its own length
+    assert table.data.nbytes == sum([len(x) for x in words])
+    query = words + [b'', b'abc', b'abcdefghij', b'c']
+    assert table.lookup(query).tolist() == list(range(len(words))) + [-1] * 4
+    assert table.take([5, 0]).tolist() == [b'b', b'a']
+    new = [b'aa', b'abcdefgha', b'z']
+    inserted, position = table.insert(new)
+    assert inserted.tolist() == sorted(words + new)
+    assert [inserted[i] for i in position.tolist()] == words + new
+    table = pickle.loads(pickle.dumps(inserted))
+    assert table.lookup(new).tolist() == position[-3:].tolist()
+    empty = StringTable.from_sorted([])
+    assert len(empty) == 0 and empty.lookup([b'a']).tolist() == [-1]
+    assert np.all(empty.insert([b'a'])[0].lookup([b'a']) == 0)
+
+
+def test_q_voc_ratio_batch():
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    half = len(text) // 2
+    for compact in [False, True]:
+        model = TextModel(text[:half], token_list=[-1, 3], compact=compact)
+        X, ratio = model.transform_q_voc_ratio_batch(text + [''])
+        assert len(X) == len(ratio) == len(text) + 1
+        for t, x, r in zip(text + [''], X, ratio):
+            tok = model.tokenize(t)
+            bow = model.dictionary.doc2bow(tok)
+            assert abs(r - len(bow) / max(float(len(tok)), 1)) < 1e-9
+            assert [k for k, v in x] == [k for k, v in model[t]]
+            for (_, v), (_, w) in zip(x, model[t]):
+                assert abs(v - w) < 1e-9
+        assert ratio[-1] == 0
+        assert (model.q_voc_ratio(text) == ratio[:-1]).all()
+
+
+def test_hashing():
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data
+    import os
+    fname = os.path.dirname(__file__) + '/text.json'
+    text = read_data(fname)
+    model = TextModel(text, token_list=[3, 4], hash_size=1024)
+    assert len(model.dictionary) == 1024
+    vec = model[text[0]]
+    assert len(vec) and max([k for k, v in vec]) < 1024
+
+
 def test_emoticons():
     from b4msa.textmodel import EmoticonClassifier, norm_chars
     emo = EmoticonClassifier()
@@ -15,6 +15,236 @@ def test_params():
     sel.search(fake_score, bsize=64, qsize=3)
 
 
+def test_expand_neighbors_ordinal():
+    from b4msa.params import ParameterSelection, _BASE_PARAMS
+    sel = ParameterSelection()
+    sel._base_params = _BASE_PARAMS
+    conf = dict(min_df=2, lc=True)
+    neighbors = [x for x in sel.expand_neighbors(conf)]
+    assert dict(min_df=2, lc=False) in neighbors
+    assert sorted([x['min_df'] for x in neighbors if x['lc']]) == [1, 3]
+
+
+def test_expand_neighbors_categorical():
+    from b4msa.params import ParameterSelection, _BASE_PARAMS
+    sel = ParameterSelection()
+    sel._base_params = _BASE_PARAMS
+    conf = dict(backend='sgd')
+    neighbors = sorted([x['backend'] for x in sel.expand_neighbors(conf)])
+    assert neighbors == sorted([x for x in _BASE_PARAMS['backend'] if x != 'sgd'])
+
+
+def test_collapse_duplicates():
+    from b4msa.utils import collapse_duplicates
+    X = [u'buen d\u00eda', u'malo', u'buen di\u0301a', u'malo', u'malo']
+    y = ['POS', 'NEG', 'POS', 'NEG', 'NEU']
+    Xu, yu, w, inverse = collapse_duplicates(X, y)
+    assert Xu == [u'buen d\u00eda', u'malo', u'malo']
+    assert yu == ['POS', 'NEG', 'NEU']
+    assert w.tolist() == [2, 2, 1]
+    assert inverse.tolist() == [0, 1, 0, 1, 2]
+
+
+def test_share_arrays():
+    from b4msa.utils import share_arrays, attach_arrays, texts_to_arrays, arrays_to_texts
+    import numpy as np
+    import os
+    texts = [u'hola', u'', u'canci\u00f3n', u'@usr']
+    data, offsets = texts_to_arrays(texts)
+    filename = share_arrays(dict(data=data, offsets=offsets, y=np.arange(4)), dict(n=4))
+    header, arrays = attach_arrays(filename)
+    assert header['n'] == 4 and isinstance(arrays['y'], np.memmap)
+    assert attach_arrays(filename)[1] is arrays
+    assert arrays_to_texts(arrays['data'], arrays['offsets']) == texts
+    os.unlink(filename)
+
+
+def test_wrapper_share():
+    from b4msa.params import Wrapper
+    from b4msa.classifier import SVC
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import pickle
+    import os
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_data_labels(fname)
+    for dedup in [False, True]:
+        f = Wrapper(X + X[:3], y + y[:3], 'macrof1', 2, SVC, dedup=dedup)
+        f.share()
+        g = pickle.loads(pickle.dumps(f))
+        os.unlink(f.filename)
+        assert 'train_X' not in f.__getstate__()
+        assert g.train_X == f.train_X and np.all(g.y == f.y)
+        for (a, b), (c, d) in zip(f.kfolds, g.kfolds):
+            assert np.all(a == c) and np.all(b == d)
+        assert 0 <= g.f((dict(token_list=[-1]), None))['_score'] <= 1
+
+
+def test_wrapper_imap():
+    from b4msa.params import Wrapper
+    from b4msa.classifier import SVC
+    from b4msa.utils import read_data_labels
+    from multiprocessing.pool import ThreadPool
+    import os
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_data_labels(fname)
+    cand = [(dict(token_list=[-1]), 'a'), (dict(token_list=[2, 3]), 'b'), (dict(token_list=[1]), 'c')]
+    pool = ThreadPool(2)
+    for Cs in [None, [0.1, 1]]:
+        f = Wrapper(X, y, 'macrof1', 3, SVC, Cs=Cs)
+        scores = {x['token_list'][0]: x['_score'] for x in f.imap([(c.copy(), code) for c, code in cand], pool, max_configs=2, chunks=3)}
+        assert len(scores) == 3
+        for c, code in cand:
+            assert scores[c['token_list'][0]] == f.f((c.copy(), code))['_score']
+    pool.close()
+
+
+def test_wrapper_imap_normalize():
+    from b4msa.params import Wrapper, attach_dataset
+    from b4msa.classifier import SVC
+    from b4msa.textmodel import TextModel
+    from b4msa.utils import read_data_labels
+    from multiprocessing import Pool, Value
+    import os
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_data_labels(fname)
+    calls = Value('i', 0)
+    normalize = TextModel.normalize
+
+    def counted(self, text):
+        with calls.get_lock():
+            calls.value += 1
+        return normalize(self, text)
+
+    cand = [(dict(token_list=[-1]), 'a'), (dict(token_list=[2, 3], strip_diac=False), 'b'),
+            (dict(token_list=[2, 3]), 'c'), (dict(token_list=[1], strip_diac=False), 'd')]
+    f = Wrapper(X, y, 'macrof1', 3, SVC)
+    files = set(os.listdir('/dev/shm'))
+    TextModel.normalize = counted
+    try:
+        pool = Pool(2, initializer=attach_dataset, initargs=(f.share(),))
+        scores = [x['_score'] for x in f.imap([(c.copy(), code) for c, code in cand], pool,
+                                              max_configs=2, chunks=3)]
+        pool.terminate()
+    finally:
+        TextModel.normalize = normalize
+        os.unlink(f.filename)
+    # the texts are normalized once for each of the two normalization keys
+    assert calls.value == 2 * len(X)
+    assert set(os.listdir('/dev/shm')) == files
+    assert sorted(scores) == sorted([f.f((c.copy(), code))['_score'] for c, code in cand])
+
+
+def test_search_halving():
+    from b4msa.params import ParameterSelection, Wrapper
+    from b4msa.classifier import SVC
+    from b4msa.utils import read_data_labels
+    import numpy as np
+    import os
+    budgets = []
+
+    def fun_score(conf_code):
+        conf = conf_code[0]
+        budgets.append(conf_code[2] if len(conf_code) > 2 else None)
+        conf['_score'] = conf['min_df'] + len(conf['token_list']) / 10.
+        return conf
+
+    np.random.seed(0)
+    best_list = ParameterSelection().search(fun_score, bsize=9, hill_climbing=False, budgets=[1, 3])
+    assert budgets.count(1) == 9 and budgets.count(3) == 3 and budgets.count(None) == 1
+    assert len(best_list) == 1 and set(best_list[0]['_halving'].keys()) == set(['1', '3'])
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_data_labels(fname)
+    f = Wrapper(X, y, 'accuracy', 3, SVC)
+    conf = f.f((dict(token_list=[-1]), None, 1))
+    tr, ts = f.kfolds[0]
+    hy = SVC.predict_kfold(X, y, 3, textModel_params=dict(token_list=[-1]), kfolds=f.kfolds)
+    assert conf['_score'] == (np.array(y)[ts] == hy[ts]).mean()
+
+
+def test_wrapper_halving_reuse():
+    from b4msa.params import Wrapper
+    from b4msa.classifier import SVC
+    from b4msa.utils import read_data_labels
+    from multiprocessing.pool import ThreadPool
+    import os
+    fname = os.path.join(os.path.dirname(__file__), "text.json")
+    X, y = read_data_labels(fname)
+    folds = []
+
+    class Counted(SVC):
+        @classmethod
+        def train_predict_pool(cls, args):
+            folds.append(len(args[2]))
+            return super(Counted, cls).train_predict_pool(args)
+
+        @classmethod
+        def train_predict_path_pool(cls, args):
+            folds.append(len(args[2]))
+            return super(Counted, cls).train_predict_path_pool(args)
+
+    pool = ThreadPool(2)
+    for Cs in [None, [0.1, 1]]:
+        expected = Wrapper(X, y, 'macrof1', 3, SVC, Cs=Cs).f((dict(token_list=[-1]), 'a'))
+        for scheduler in [None, pool]:
+            f = Wrapper(X, y, 'macrof1', 3, Counted, Cs=Cs)
+            del folds[:]
+            for budget in [1, 2, None]:
+                conf_code = (dict(token_list=[-1]), 'a', budget)
+                if scheduler is None:
+                    conf = f.f(conf_code)
+                else:
+                    conf = list(f.imap([conf_code], pool))[0]
+            # each fold is trained once
+            assert len(folds) == 3 and len(f.folds) == 0
+            assert conf['_score'] == expected['_score']
+    pool.close()
+
+
+def test_search_refine():
+    from b4msa.params import ParameterSelection
+    from b4msa.utils import stratified_subsample
+    import numpy as np
+    y = ['a'] * 10 + ['b'] * 3 + ['c'] * 6
+    index = stratified_subsample(y, 4, seed=1)
+    assert sorted([y[i] for i in index]) == ['a'] * 4 + ['b'] * 3 + ['c'] * 4
+    assert np.all(np.diff(index) > 0)
+
+    def fun_score(conf_code):
+        conf = conf_code[0]
+        conf['_score'] = -conf['min_df'] - len(conf['token_list']) / 10.
+        return conf
+
+    np.random.seed(0)
+    search = ParameterSelection()
+    best_list = search.search(lambda x: dict(x[0], _score=len(x[0]['token_list'])), bsize=8, hill_climbing=False)
+    refined = search.refine(best_list, fun_score, top=3)
+    assert len(refined) == 3
+    assert sorted([x['_subsample_rank'] for x in refined]) == [0, 1, 2]
+    for x in refined:
+        assert x['_subsample_score'] == best_list[x['_subsample_rank']]['_score']
+        assert x['_score'] == -x['min_df'] - len(x['token_list']) / 10.
+    assert refined[0]['_score'] >= refined[-1]['_score']
+
+
+def test_wrapper_score_missing_class():
+    from b4msa.params import Wrapper
+    from sklearn.metrics import f1_score
+    import numpy as np
+    y = np.array(['NEG', 'NEU', 'POS'] * 4)
+    hy = np.array([0, 2, 2] * 4)
+    w = Wrapper(None, y, 'avgf1:NEG:POS', 2, None)
+    # the evaluated samples do not contain NEU
+    index = np.where(y != 'NEU')[0]
+    conf = {}
+    w.compute_score(conf, hy, index)
+    assert sorted(conf['_all_f1'].keys()) == ['NEG', 'NEU', 'POS']
+    assert conf['_all_f1']['NEG'] == 1 and conf['_all_f1']['NEU'] == 0
+    assert conf['_all_f1']['POS'] == f1_score(y[index] == 'POS', hy[index] == 2)
+    assert conf['_score'] == (conf['_all_f1']['NEG'] + conf['_all_f1']['POS']) / 2
+    assert conf['_macrof1'] == np.mean(list(conf['_all_f1'].values()))
+
+
 def test_read_data_labels():
     import os
     from b4msa.utils import read_data_labels
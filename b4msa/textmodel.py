@@ -21,12 +21,18 @@ sys.setdefaultencoding('utf8')
 import re
 import os
 import unicodedata
+import zlib
+import copy
+import bisect
+import numpy as np
+from scipy.sparse import csr_matrix
 from gensim import corpora
-from gensim.models.tfidfmodel import TfidfModel
+from gensim.utils import to_utf8
+from gensim.models.tfidfmodel import TfidfModel, precompute_idfs
 from .params import OPTION_DELETE, OPTION_GROUP, OPTION_NONE, get_filename
 from .lang_dependency import LangDependency
 from .utils import tweet_iterator
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import pickle
 import logging
 
@@ -184,7 +190,529 @@ def expand_qgrams_word_list(wlist, qsize, output, sep='~'):
     return output
 
 
+class CountMinSketch(object):
+    """Approximate counting of tokens in a fixed amount of memory; the estimates
+    are never below the true counts"""
+    def __init__(self, width=2 ** 20, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+
+    def hashes(self, tokens):
+        tokens = [to_utf8(t) for t in tokens]
+        h1 = np.array([zlib.crc32(t) & 0xffffffff for t in tokens], dtype=np.int64)
+        h2 = np.array([zlib.adler32(t) & 0xffffffff for t in tokens], dtype=np.int64)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, tokens):
+        """Increments by one the counter of each token"""
+        for row, index in zip(self.table, self.hashes(tokens)):
+            np.add.at(row, index, 1)
+
+    def estimate(self, tokens):
+        if len(tokens) == 0:
+            return np.zeros(0, dtype=self.table.dtype)
+
+        return np.min([row[index] for row, index in zip(self.table, self.hashes(tokens))], axis=0)
+
+
+def _prefixes(data, offsets, block=1 << 20):
+    """First 8 bytes of each string of the blob `data`, zero padded, as big-endian integers;
+    they are in the same order as the strings"""
+    n = offsets.shape[0] - 1
+    prefix = np.zeros(n, dtype=np.uint64)
+    if data.shape[0] == 0:
+        return prefix
+
+    shifts = (8 * np.arange(7, -1, -1)).astype(np.uint64)
+    for a in range(0, n, block):
+        b = min(a + block, n)
+        starts, ends = offsets[a:b], offsets[a + 1:b + 1]
+        index = starts[:, np.newaxis] + np.arange(8)
+        c = np.where(index < ends[:, np.newaxis], data[np.minimum(index, data.shape[0] - 1)], 0)
+        prefix[a:b] = (c.astype(np.uint64) << shifts).sum(axis=1)
+    return prefix
+
+
+def _join(strings):
+    """Blob and offsets of a list of byte strings"""
+    offsets = np.cumsum([0] + [len(x) for x in strings]).astype(np.int64)
+    return np.frombuffer(b''.join(strings), dtype=np.uint8), offsets
+
+
+class StringTable(object):
+    """Sorted utf-8 strings stored as one blob and the offset of each one, the layout of
+    utils.texts_to_arrays, so a string takes its length instead of that of the longest.
+    The first 8 bytes of each string (`prefix`) narrow the binary search of `lookup`
+    to the strings sharing them."""
+    __slots__ = ['data', 'offsets', 'prefix']
+
+    def __init__(self, data, offsets, prefix=None):
+        self.data = data
+        self.offsets = offsets
+        self.prefix = _prefixes(data, offsets) if prefix is None else prefix
+
+    @classmethod
+    def from_sorted(cls, strings):
+        """Table of the sorted, distinct byte strings `strings`"""
+        return cls(*_join(strings))
+
+    def get_arrays(self, name):
+        return {name: self.data, name + '_offsets': self.offsets, name + '_prefix': self.prefix}
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        """Table stored with get_arrays, or None"""
+        if name + '_offsets' not in arrays:
+            return None
+
+        return cls(arrays[name], arrays[name + '_offsets'], arrays[name + '_prefix'])
+
+    def __getstate__(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes + self.prefix.nbytes
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def tolist(self):
+        data, offsets = self.data.tobytes(), self.offsets.tolist()
+        return [data[a:b] for a, b in zip(offsets, offsets[1:])]
+
+    def take(self, index):
+        """Table with the strings at the positions `index`, in that order"""
+        index = np.asarray(index, dtype=np.int64)
+        starts = self.offsets[index]
+        lengths = self.offsets[index + 1] - starts
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        source = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return StringTable(np.array(self.data[source]), offsets, np.array(self.prefix[index]))
+
+    def range(self, prefix):
+        """Positions of the first string with each of the `prefix` values, and after the last"""
+        return (np.searchsorted(self.prefix, prefix, side='left'),
+                np.searchsorted(self.prefix, prefix, side='right'))
+
+    def lookup(self, strings):
+        """Positions of the byte strings `strings`; the missing ones are -1"""
+        pos = -np.ones(len(strings), dtype=np.int64)
+        if len(strings) == 0 or len(self) == 0:
+            return pos
+
+        data, offsets = _join(strings)
+        lengths = np.diff(offsets)
+        lo, hi = self.range(_prefixes(data, offsets))
+        # strings of at most 8 bytes are equal when their prefixes and lengths are
+        short = (hi - lo == 1) & (lengths <= 8)
+        first = np.minimum(lo, len(self) - 1)
+        found = short & (np.diff(self.offsets)[first] == lengths)
+        pos[found] = lo[found]
+        for i in np.where((hi > lo) & ~short)[0].tolist():
+            j = bisect.bisect_left(self, strings[i], int(lo[i]), int(hi[i]))
+            if j < hi[i] and self[j] == strings[i]:
+                pos[i] = j
+        return pos
+
+    def insert(self, strings):
+        """Table with the sorted, new byte strings `strings`, and the position in it of
+        each string of this table followed by those of `strings`"""
+        data, offsets = _join(strings)
+        lo, hi = self.range(_prefixes(data, offsets))
+        at = np.array([bisect.bisect_left(self, x, a, b) for x, a, b in zip(strings, lo.tolist(), hi.tolist())],
+                      dtype=np.int64)
+        n, m = len(self), len(strings)
+        position = np.concatenate((np.arange(n) + np.searchsorted(at, np.arange(n), side='right'),
+                                   at + np.arange(m))).astype(np.int64)
+        table = StringTable(np.concatenate((self.data, data)),
+                            np.concatenate((self.offsets[:-1], offsets + self.offsets[-1])),
+                            np.concatenate((self.prefix, _prefixes(data, offsets))))
+        order = np.empty(n + m, dtype=np.int64)
+        order[position] = np.arange(n + m)
+        return table.take(order), position
+
+
+def prune_terms(dfs, num_docs, min_df=1, max_df=1.0, max_features=None):
+    """Positions of the terms kept by the pruning of TextModel, given their document
+    frequencies `dfs` in the order gensim numbers them, i.e., by the first document
+    where they appear. As gensim's Dictionary.filter_extremes, but the ties of
+    `max_features` keep the first terms instead of depending on the order of a dict."""
+    index = np.where((dfs >= min_df) & (dfs <= int(max_df * num_docs)))[0]
+    if max_features is not None:
+        order = np.argsort(-dfs[index], kind='mergesort')
+        index = np.sort(index[order[:max_features]])
+    return index
+
+
+class TokenCache(object):
+    """Token counts of a corpus, tokenized once, from which the vocabulary and the TF-IDF
+    matrices of any train/test split are computed without tokenizing again. The document
+    frequencies of the training part are the global ones minus those of the test part."""
+    def __init__(self, docs, hash_size=None):
+        """`docs` are the token lists of the corpus"""
+        self.hash_size = hash_size
+        self.num_docs = len(docs)
+        lengths = np.array([len(d) for d in docs], dtype=np.int64)
+        tokens = [to_utf8(t) for d in docs for t in d]
+        if hash_size:
+            self.tokens = None
+            ids = np.array([zlib.adler32(t) % hash_size for t in tokens], dtype=np.int64)
+            size = hash_size
+        else:
+            # the ids are given by a dict, the table is built only with the distinct tokens
+            index = {}
+            ids = np.array([index.setdefault(t, len(index)) for t in tokens], dtype=np.int64)
+            distinct = sorted(index)
+            rank = np.empty(len(distinct), dtype=np.int64)
+            rank[[index[t] for t in distinct]] = np.arange(len(distinct))
+            ids = rank[ids]
+            self.tokens = StringTable.from_sorted(distinct)
+            size = max(len(distinct), 1)
+        doc = np.repeat(np.arange(self.num_docs, dtype=np.int64), lengths)
+        key, counts = np.unique(doc * size + ids, return_counts=True)
+        self.doc, self.ids, self.counts = key // size, key % size, counts.astype(np.float64)
+        self.size = size if hash_size else len(self.tokens)
+        self.dfs = np.bincount(self.ids, minlength=self.size)
+
+    def get_arrays(self):
+        """Header and arrays to rebuild the cache with `from_arrays`"""
+        arrays = dict(doc=self.doc, ids=self.ids, counts=self.counts, dfs=self.dfs)
+        if self.tokens is not None:
+            arrays.update(self.tokens.get_arrays('tokens'))
+        header = dict(num_docs=self.num_docs, size=self.size, hash_size=self.hash_size)
+        return header, arrays
+
+    @classmethod
+    def from_arrays(cls, header, arrays):
+        cache = cls.__new__(cls)
+        cache.num_docs, cache.size, cache.hash_size = header['num_docs'], header['size'], header['hash_size']
+        cache.doc, cache.ids, cache.counts, cache.dfs = arrays['doc'], arrays['ids'], arrays['counts'], arrays['dfs']
+        cache.tokens = StringTable.from_arrays(arrays, 'tokens')
+        if cache.tokens is None and not cache.hash_size:
+            cache.tokens = StringTable.from_sorted([])
+        return cache
+
+    @classmethod
+    def merge(cls, caches):
+        """Cache of the concatenation of the corpora of `caches`, e.g., tokenized in parts"""
+        cache = cls.__new__(cls)
+        cache.hash_size = caches[0].hash_size
+        cache.num_docs = sum([c.num_docs for c in caches])
+        offsets = np.cumsum([0] + [c.num_docs for c in caches[:-1]])
+        doc = np.concatenate([c.doc + offset for c, offset in zip(caches, offsets)])
+        if cache.hash_size:
+            cache.tokens = None
+            cache.size = cache.hash_size
+            ids = np.concatenate([c.ids for c in caches])
+        else:
+            # the tokens of each part are sorted, so the new ids keep the order within each document
+            tokens = [c.tokens.tolist() for c in caches]
+            distinct = sorted(set([t for part in tokens for t in part]))
+            index = dict((t, i) for i, t in enumerate(distinct))
+            cache.tokens = StringTable.from_sorted(distinct)
+            cache.size = len(distinct)
+            ids = np.concatenate([np.array([index[t] for t in part], dtype=np.int64)[c.ids]
+                                  for c, part in zip(caches, tokens)])
+        cache.doc, cache.ids = doc, ids.astype(np.int64)
+        cache.counts = np.concatenate([c.counts for c in caches])
+        cache.dfs = np.bincount(cache.ids, minlength=cache.size)
+        return cache
+
+    @classmethod
+    def from_texts(cls, model, texts, normalized=None):
+        """Tokenizes `texts` with the TextModel `model`; the normalized texts are taken
+        from the NormalizedCache `normalized` when it is given"""
+        if normalized is None:
+            return cls([model.tokenize(text) for text in texts], hash_size=model.hash_size)
+
+        return cls([model.expand(text) for text in normalized.get(model, texts)],
+                   hash_size=model.hash_size)
+
+    def vocabulary(self, test, min_df=1, max_df=1.0, max_features=None):
+        """Vocabulary of the documents not in `test`, with the pruning of TextModel, and
+        the id of each global token in it (-1 when it is not included)"""
+        mask = np.zeros(self.num_docs, dtype=np.bool)
+        mask[test] = True
+        dfs = self.dfs - np.bincount(self.ids[mask[self.doc]], minlength=self.size)
+        num_docs = self.num_docs - int(mask.sum())
+        if self.hash_size:
+            idfs = np.zeros(self.size, dtype=np.float64)
+            idfs[dfs > 0] = np.log(float(num_docs) / dfs[dfs > 0]) / np.log(2)
+            return Vocabulary(None, None, dfs.astype(np.int32), idfs, num_docs,
+                              hash_size=self.hash_size), np.arange(self.size)
+
+        keep = np.where(dfs > 0)[0]
+        if min_df > 1 or max_df < 1.0 or max_features is not None:
+            # the terms in the order gensim numbers them in the training part: by the first
+            # document where they appear and, in the same document, by the token
+            train = ~mask[self.doc]
+            ids, first = np.unique(self.ids[train], return_index=True)
+            ids = ids[np.lexsort((ids, self.doc[train][first]))]
+            keep = np.sort(ids[prune_terms(dfs[ids], num_docs, min_df, max_df, max_features)])
+        newids = -np.ones(self.size, dtype=np.int64)
+        newids[keep] = np.arange(keep.shape[0])
+        idfs = np.log(float(num_docs) / dfs[keep]) / np.log(2)
+        return Vocabulary(self.tokens.take(keep), np.arange(keep.shape[0], dtype=np.int32),
+                          dfs[keep].astype(np.int32), idfs, num_docs), newids
+
+    def tfidf(self, vocabulary, newids, docs):
+        """TF-IDF sparse matrix (CSR) of the documents `docs` with the `vocabulary`"""
+        position = -np.ones(self.num_docs, dtype=np.int64)
+        position[docs] = np.arange(len(docs))
+        doc, ids = position[self.doc], newids[self.ids]
+        mask = (doc >= 0) & (ids >= 0)
+        doc, ids, counts = doc[mask], ids[mask], self.counts[mask]
+        order = np.argsort(doc, kind='mergesort')
+        doc, ids, w = vocabulary.tfidf_triplets(doc[order], ids[order], counts[order], len(docs))
+        return csr_matrix((w, (doc, ids)), shape=(len(docs), len(vocabulary)))
+
+
+class NormalizedCache(object):
+    """Normalized texts (TextModel.normalize) of corpora keyed by the parameters of the
+    normalization, so the models differing only in `token_list`, or in options without
+    effect, share them; it keeps the `max_entries` most recent ones"""
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, model, texts):
+        key = (model.normalize_key(), len(texts), hash(tuple(texts)))
+        value = self.entries.pop(key, None)
+        if value is None:
+            value = [model.normalize(text) for text in texts]
+            if len(self.entries) >= self.max_entries:
+                self.entries.popitem(last=False)
+        self.entries[key] = value
+        return value
+
+
+class MinHash(object):
+    """Near-duplicate detection with MinHash signatures of token sets and LSH banding.
+    Two documents are candidates when a band of `num_perm // bands` values of their
+    signatures agree, and are near-duplicates when the fraction of agreeing values,
+    an estimate of the Jaccard similarity of their tokens, reaches `threshold`."""
+    prime = 2 ** 31 - 1
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.8, seed=0):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        rs = np.random.RandomState(seed)
+        self.a = rs.randint(1, self.prime, size=num_perm).astype(np.int64)
+        self.b = rs.randint(0, self.prime, size=num_perm).astype(np.int64)
+
+    def signature(self, tokens):
+        if len(tokens) == 0:
+            return np.zeros(self.num_perm, dtype=np.int64)
+
+        h = np.array([zlib.crc32(to_utf8(t)) & 0xffffffff for t in set(tokens)], dtype=np.int64) % self.prime
+        return ((self.a[:, np.newaxis] * h + self.b[:, np.newaxis]) % self.prime).min(axis=1)
+
+    def cache_signatures(self, cache):
+        """Signatures of the documents of the TokenCache `cache`, the same as `signature`
+        without tokenizing again; in hashing mode the token ids stand for the tokens"""
+        if cache.tokens is None:
+            h = cache.ids
+        else:
+            h = np.array([zlib.crc32(t) & 0xffffffff for t in cache.tokens.tolist()], dtype=np.int64)
+            h = h[cache.ids] % self.prime
+        signatures = np.zeros((cache.num_docs, self.num_perm), dtype=np.int64)
+        docs = np.unique(cache.doc)
+        if docs.shape[0] == 0:
+            return signatures
+
+        # the cache is sorted by document
+        start = np.searchsorted(cache.doc, docs)
+        for k in range(self.num_perm):
+            signatures[docs, k] = np.minimum.reduceat((self.a[k] * h + self.b[k]) % self.prime, start)
+        return signatures
+
+    def clusters(self, docs, labels=None, signatures=None):
+        """Cluster of each tokenized document in `docs`, given as the position of its
+        first member; documents with different labels are never in the same cluster.
+        The `signatures` of the documents replace `docs` when they are given."""
+        if signatures is None:
+            signatures = np.array([self.signature(d) for d in docs]).reshape(len(docs), self.num_perm)
+        labels = [None] * signatures.shape[0] if labels is None else labels
+        parent = np.arange(signatures.shape[0])
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        rows = self.num_perm // self.bands
+        for band in range(self.bands):
+            buckets = {}
+            for i, (sig, label) in enumerate(zip(signatures[:, band * rows:(band + 1) * rows], labels)):
+                j = buckets.setdefault((label, sig.tobytes()), i)
+                if j == i:
+                    continue
+                a, b = find(i), find(j)
+                if a != b and (signatures[i] == signatures[j]).mean() >= self.threshold:
+                    parent[max(a, b)] = min(a, b)
+
+        return np.array([find(i) for i in range(parent.shape[0])], dtype=np.int64)
+
+    def collapse(self, docs, X, y, signatures=None):
+        """Collapses the near-duplicates of `X` (tokenized in `docs`, or given by their
+        `signatures`) with the same label into their first member; returns the same as
+        b4msa.utils.collapse_duplicates"""
+        clusters = self.clusters(docs, y, signatures=signatures)
+        first, inverse = np.unique(clusters, return_inverse=True)
+        weights = np.bincount(inverse).astype(np.float64)
+        return [X[i] for i in first], [y[i] for i in first], weights, inverse.astype(np.int64)
+
+
+class Vocabulary(object):
+    """Compact replacement of the gensim dictionary and TF-IDF model of a fitted
+    TextModel. The tokens are kept in a StringTable of sorted utf-8 strings, or
+    are hashed when `hash_size` is given, and the document frequencies and IDF
+    weights in arrays indexed by the token id. It provides `doc2bow` and the
+    TF-IDF `__getitem__` used by TextModel."""
+    __slots__ = ['tokens', 'ids', 'dfs', 'idfs', 'num_docs', 'hash_size']
+    eps = 1e-12
+
+    def __init__(self, tokens, ids, dfs, idfs, num_docs, hash_size=None):
+        self.tokens = tokens
+        self.ids = ids
+        self.dfs = dfs
+        self.idfs = idfs
+        self.num_docs = num_docs
+        self.hash_size = hash_size
+
+    @classmethod
+    def from_gensim(cls, dictionary, model):
+        """Converts a gensim (Hash)Dictionary and its TfidfModel"""
+        size = len(dictionary)
+        dfs = np.zeros(size, dtype=np.int32)
+        idfs = np.zeros(size, dtype=np.float64)
+        for k, v in model.dfs.items():
+            dfs[k] = v
+        for k, v in model.idfs.items():
+            idfs[k] = v
+
+        if isinstance(dictionary, corpora.HashDictionary):
+            return cls(None, None, dfs, idfs, model.num_docs, hash_size=dictionary.id_range)
+
+        tokens = sorted((to_utf8(k), v) for k, v in dictionary.token2id.items())
+        ids = np.array([v for k, v in tokens], dtype=np.int32)
+        tokens = StringTable.from_sorted([k for k, v in tokens])
+        return cls(tokens, ids, dfs, idfs, model.num_docs)
+
+    def __getstate__(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+        if isinstance(self.tokens, np.ndarray):
+            # pickled by the versions keeping the tokens in a fixed-width array
+            self.tokens = StringTable.from_sorted(self.tokens.tolist())
+
+    def __len__(self):
+        return self.dfs.shape[0]
+
+    def keep(self, ids):
+        """Vocabulary with only the terms `ids` (sorted), numbered again in the same order"""
+        if self.hash_size:
+            raise ValueError("The columns of a hashing model cannot be removed")
+        newids = -np.ones(len(self), dtype=np.int64)
+        newids[ids] = np.arange(len(ids))
+        newids = newids[self.ids]
+        mask = newids >= 0
+        return Vocabulary(self.tokens.take(np.where(mask)[0]), newids[mask].astype(np.int32), np.array(self.dfs[ids]),
+                          np.array(self.idfs[ids]), self.num_docs)
+
+    def lookup(self, tokens):
+        """Ids of `tokens`; the unknown ones are -1"""
+        if self.hash_size:
+            return np.array([zlib.adler32(to_utf8(t)) % self.hash_size for t in tokens], dtype=np.int64)
+
+        pos = self.tokens.lookup([to_utf8(t) for t in tokens])
+        return np.where(pos >= 0, self.ids[np.maximum(pos, 0)], -1) if len(self.tokens) else pos
+
+    def doc2bow(self, tokens):
+        ids = self.lookup(tokens)
+        ids, counts = np.unique(ids[ids >= 0], return_counts=True)
+        return list(zip(ids.tolist(), counts.tolist()))
+
+    def __getitem__(self, bow):
+        ids = np.array([k for k, v in bow], dtype=np.int64)
+        counts = np.array([v for k, v in bow], dtype=np.float64)
+        return self.tfidf(np.zeros(ids.shape[0], dtype=np.int64), ids, counts, 1)[0]
+
+    def tfidf(self, doc, ids, counts, size):
+        """TF-IDF vectors of `size` documents given as the triplets (`doc`, `ids`, `counts`)
+        sorted by document"""
+        doc, ids, w = self.tfidf_triplets(doc, ids, counts, size)
+        limits = np.searchsorted(doc, np.arange(size + 1)).tolist()
+        ids, w = ids.tolist(), w.tolist()
+        return [list(zip(ids[a:b], w[a:b])) for a, b in zip(limits, limits[1:])]
+
+    def tfidf_triplets(self, doc, ids, counts, size):
+        """Same as `tfidf` with the output given as the triplets (document, id, weight)"""
+        w = counts * self.idfs[ids]
+        mask = np.fabs(self.idfs[ids]) > self.eps
+        doc, ids, w = doc[mask], ids[mask], w[mask]
+        norm = np.sqrt(np.bincount(doc, weights=w ** 2, minlength=size))
+        w = w / norm[doc]
+        mask = np.fabs(w) > self.eps
+        return doc[mask], ids[mask], w[mask]
+
+    def add_documents(self, docs):
+        """Counts the token lists `docs`; new tokens are appended to the vocabulary"""
+        new = {}
+        dfs = {}
+        for d in docs:
+            # new ids are given in the order used by gensim's Dictionary
+            d = sorted(set(d))
+            ids = self.lookup(d)
+            for j in np.where(ids < 0)[0]:
+                ids[j] = new.setdefault(to_utf8(d[j]), len(self) + len(new))
+            for i in np.unique(ids).tolist():
+                dfs[i] = dfs.get(i, 0) + 1
+
+        if len(new):
+            tokens = sorted(new.items())
+            self.tokens, position = self.tokens.insert([k for k, v in tokens])
+            ids = np.empty(len(self.tokens), dtype=np.int32)
+            ids[position] = np.concatenate((self.ids, [v for k, v in tokens]))
+            self.ids = ids
+            self.dfs = np.concatenate((self.dfs, np.zeros(len(new), dtype=self.dfs.dtype)))
+        elif not self.dfs.flags.writeable:
+            # e.g., a read-only memory map
+            self.dfs = np.array(self.dfs)
+
+        for k, v in dfs.items():
+            self.dfs[k] += v
+
+        self.num_docs += len(docs)
+        self.idfs = np.zeros(len(self), dtype=np.float64)
+        mask = self.dfs > 0
+        self.idfs[mask] = np.log(float(self.num_docs) / self.dfs[mask]) / np.log(2)
+
+
 class TextModel:
+    # defaults of the attributes added after the first versions, so the models
+    # pickled by them can still be loaded and used
+    min_df = 1
+    max_df = 1.0
+    max_features = None
+    hash_size = None
+    sketch_width = None
+    sketch_depth = 4
+
     def __init__(self,
                  docs,
                  strip_diac=True,
@@ -196,6 +724,13 @@ class TextModel:
                  del_dup1=True,
                  token_list=[-1],
                  lang="portuguese",
+                 min_df=1,
+                 max_df=1.0,
+                 max_features=None,
+                 hash_size=None,
+                 sketch_width=None,
+                 sketch_depth=4,
+                 compact=False,
                  **kwargs
     ):
         self.strip_diac = strip_diac
@@ -214,6 +749,12 @@ class TextModel:
         self.lc = lc
         self.del_dup1 = del_dup1
         self.token_list = token_list
+        self.min_df = min_df
+        self.max_df = max_df
+        self.max_features = max_features
+        self.hash_size = hash_size
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
 
         # DOUGLAS - Set up the self.lang to Brazilian Portuguese
         #self.lang = "portuguese"
@@ -226,10 +767,25 @@ class TextModel:
             
         self.kwargs = {k: v for k, v in kwargs.items() if k[0] != '_'}
 
-        docs = [self.tokenize(d) for d in docs]
-        self.dictionary = corpora.Dictionary(docs)
-        corpus = [self.dictionary.doc2bow(d) for d in docs]
-        self.model = TfidfModel(corpus)
+        if self.sketch_width and not self.hash_size:
+            self.dictionary = self.sketch_dictionary(docs)
+            self.prune_dictionary()
+            self.model = TfidfModel(dictionary=self.dictionary)
+        else:
+            docs = [self.tokenize(d) for d in docs]
+            if self.hash_size:
+                # tokens are hashed into a fixed number of columns, there is no vocabulary to keep
+                self.dictionary = corpora.HashDictionary(docs, id_range=self.hash_size, debug=False)
+                # otherwise every doc2bow call would count as a new document
+                self.dictionary.allow_update = False
+            else:
+                self.dictionary = corpora.Dictionary(docs)
+                self.prune_dictionary()
+            corpus = [self.dictionary.doc2bow(d) for d in docs]
+            self.model = TfidfModel(corpus)
+
+        if compact:
+            self.compact()
 
     def __str__(self):
         return "[TextModel {0}]".format(dict(
@@ -242,23 +798,183 @@ class TextModel:
             del_dup1=self.del_dup1,
             token_list=self.token_list,
             lang=self.lang,
+            min_df=self.min_df,
+            max_df=self.max_df,
+            max_features=self.max_features,
+            hash_size=self.hash_size,
+            sketch_width=self.sketch_width,
+            sketch_depth=self.sketch_depth,
+            compact=isinstance(self.model, Vocabulary),
             kwargs=self.kwargs
         ))
 
+    def get_params(self):
+        """Parameters needed to tokenize as this model does"""
+        params = dict(
+            strip_diac=self.strip_diac,
+            num_option=self.num_option,
+            usr_option=self.usr_option,
+            url_option=self.url_option,
+            emo_option=self.emo_option,
+            lc=self.lc,
+            del_dup1=self.del_dup1,
+            token_list=list(self.token_list),
+            lang=self.lang.lang if self.lang else None,
+            hash_size=self.hash_size
+        )
+        params.update(self.kwargs)
+        return params
+
+    def sketch_dictionary(self, docs):
+        """Builds the dictionary in two passes over `docs`. The first one estimates the
+        document frequencies with a count-min sketch, and the second one only counts
+        the tokens whose estimate reaches `min_df`. Peak memory is bounded by the
+        sketch and the surviving tokens; `docs` must be iterable twice."""
+        sketch = CountMinSketch(width=self.sketch_width, depth=self.sketch_depth)
+        for d in docs:
+            sketch.add(list(set(self.tokenize(d))))
+
+        dictionary = corpora.Dictionary()
+        for d in docs:
+            tokens = self.tokenize(d)
+            keep = sketch.estimate(tokens) >= self.min_df
+            dictionary.add_documents([[t for t, k in zip(tokens, keep) if k]], prune_at=None)
+
+        return dictionary
+
+    def prune_dictionary(self):
+        """Removes the tokens appearing in less than `min_df` documents or in more
+        than a `max_df` fraction of them, and keeps the `max_features` most frequent;
+        the ties keep the tokens seen first (see prune_terms)"""
+        if self.min_df <= 1 and self.max_df >= 1.0 and self.max_features is None:
+            return
+
+        dictionary = self.dictionary
+        dfs = np.array([dictionary.dfs.get(i, 0) for i in range(len(dictionary))], dtype=np.int64)
+        keep = prune_terms(dfs, dictionary.num_docs, self.min_df, self.max_df, self.max_features)
+        dictionary.filter_tokens(good_ids=keep.tolist())
+
+    def compact(self):
+        """Replaces the gensim dictionary and TF-IDF model with a Vocabulary; it
+        takes a fraction of their memory and it is faster to pickle and load"""
+        if not isinstance(self.model, Vocabulary):
+            self.dictionary = self.model = Vocabulary.from_gensim(self.dictionary, self.model)
+        return self
+
+    def keep(self, ids):
+        """Copy of the model whose vocabulary only has the terms `ids` (sorted), numbered
+        again in the same order; the copy uses a Vocabulary (see compact)"""
+        vocabulary = self.model
+        if not isinstance(vocabulary, Vocabulary):
+            vocabulary = Vocabulary.from_gensim(self.dictionary, self.model)
+        model = copy.copy(self)
+        model.dictionary = model.model = vocabulary.keep(ids)
+        return model
+
+    def update(self, docs, tokenized=False):
+        """Adds `docs` to the model without rebuilding it. New tokens are appended to the
+        dictionary, so the ids of the known tokens, and therefore the columns of a
+        fitted classifier, do not change. Tokens removed by `min_df`, `max_df` or
+        `max_features` are counted again from `docs` if they reappear. With `tokenized`,
+        `docs` are the lists of tokens given by `tokenize`."""
+        if not tokenized:
+            docs = [self.tokenize(d) for d in docs]
+        if isinstance(self.dictionary, Vocabulary):
+            self.dictionary.add_documents(docs)
+            return self
+
+        if not self.hash_size:
+            self.dictionary.add_documents(docs, prune_at=None)
+
+        if self.model.num_docs is None:
+            # the model was created without documents
+            self.model.dfs, self.model.num_docs, self.model.num_nnz = {}, 0, 0
+
+        # HashDictionary does not keep document frequencies, so these are counted here
+        dfs = self.model.dfs
+        for d in docs:
+            bow = self.dictionary.doc2bow(d)
+            self.model.num_nnz += len(bow)
+            for k, _ in bow:
+                dfs[k] = dfs.get(k, 0) + 1
+
+        self.model.num_docs += len(docs)
+        self.model.idfs = precompute_idfs(self.model.wglobal, dfs, self.model.num_docs)
+        return self
+
     def __getitem__(self, text):
-        return self.model[self.dictionary.doc2bow(self.tokenize(text))]
+        return self.vector(self.tokenize(text))
+
+    def vector(self, tokens):
+        """TF-IDF vector of the tokens of a text"""
+        return self.model[self.dictionary.doc2bow(tokens)]
 
     def transform_q_voc_ratio(self, text):
-        tok = self.tokenize(text)
-        bow = self.dictionary.doc2bow(tok)
-        m = self.model[bow]
-        try:
-            return m, len(bow) / len(tok)
-        except ZeroDivisionError:
-            return m, 0
+        X, ratio = self.transform_q_voc_ratio_batch([text])
+        return X[0], ratio[0]
+
+    def transform_q_voc_ratio_batch(self, texts):
+        """TF-IDF vectors of `texts` and their ratios of known tokens"""
+        doc, ids, counts, ratio = self.count_known(texts)
+        if isinstance(self.model, Vocabulary):
+            return self.model.tfidf(doc, ids, counts, len(ratio)), ratio
+
+        limits = np.searchsorted(doc, np.arange(len(ratio) + 1)).tolist()
+        ids, counts = ids.tolist(), counts.tolist()
+        return [self.model[list(zip(ids[a:b], counts[a:b]))] for a, b in zip(limits, limits[1:])], ratio
+
+    def q_voc_ratio(self, texts):
+        """Ratio of known tokens of each text, i.e., the number of distinct tokens
+        in the vocabulary over the number of tokens"""
+        return self.count_known(texts)[-1]
+
+    def count_known(self, texts):
+        """Bag of words of `texts` as the triplets (document, id, count) sorted by document
+        and id, followed by the ratios of known tokens. Out-of-vocabulary tokens are
+        removed right after tokenizing, before counting."""
+        tokens = [self.tokenize(text) for text in texts]
+        lengths = np.array([len(tok) for tok in tokens], dtype=np.int64)
+        ids = self.lookup([t for tok in tokens for t in tok])
+        doc = np.repeat(np.arange(len(tokens), dtype=np.int64), lengths)
+        known = ids >= 0
+        size = max(len(self.dictionary), 1)
+        key, counts = np.unique(doc[known] * size + ids[known], return_counts=True)
+        doc, ids = key // size, key % size
+        ratio = np.bincount(doc, minlength=len(tokens)) / np.maximum(lengths, 1).astype(np.float64)
+        return doc, ids, counts.astype(np.float64), ratio
+
+    def get_idfs(self):
+        """IDF weights as an array indexed by token id"""
+        if isinstance(self.model, Vocabulary):
+            return self.model.idfs.copy()
+
+        idfs = np.zeros(len(self.dictionary), dtype=np.float64)
+        for k, v in self.model.idfs.items():
+            idfs[k] = v
+        return idfs
+
+    def lookup(self, tokens):
+        """Ids of `tokens`; the unknown ones are -1"""
+        if isinstance(self.dictionary, Vocabulary):
+            return self.dictionary.lookup(tokens)
+
+        if self.hash_size:
+            return np.array([self.dictionary.restricted_hash(t) for t in tokens], dtype=np.int64)
+
+        token2id = self.dictionary.token2id
+        return np.array([token2id.get(t, -1) for t in tokens], dtype=np.int64)
 
     def tokenize(self, text):
         # print("tokenizing", str(self), text)
+        return self.expand(self.normalize(text))
+
+    def normalize_key(self):
+        """Parameters used by `normalize`; models with the same key normalize equally"""
+        return (self.strip_diac, self.num_option, self.url_option, self.usr_option,
+                self.lang.lang if self.lang else None, tuple(sorted(self.kwargs.items())))
+
+    def normalize(self, text):
+        """Text before the q-gram expansion"""
         if text is None:
             text = ''
 
@@ -294,7 +1010,11 @@ class TextModel:
         #if self.lang:
         if True:
             text = self.lang.transform(text, **self.kwargs)
-            
+
+        return text
+
+    def expand(self, text):
+        """Tokens of the normalized `text` given by `token_list`"""
         L = []
         textlist = None
 
@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import json
 import gzip
+import tempfile
 import logging
+import struct
+import unicodedata
+import numpy as np
+from collections import OrderedDict
 from sklearn.metrics import f1_score
 import io
 logging.basicConfig(format='%(asctime)s : %(levelname)s :%(message)s')
@@ -103,5 +109,154 @@ def read_data(filename, get_tweet='text', maxitems=1e100):
     return data
 
 
+def batches(iterable, size):
+    """Splits `iterable` into lists of at most `size` items"""
+    batch = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if len(batch):
+        yield batch
+
+
+def collapse_duplicates(X, y):
+    """Collapses the identical (text, label) pairs; the texts are compared after the
+    Unicode NFD normalization TextModel applies before tokenizing, so the duplicates
+    have the same tokens. Returns the unique texts and labels, the number of copies
+    of each one, and the position of every pair among the unique ones."""
+    index = {}
+    inverse = []
+    Xu, yu, weights = [], [], []
+    for text, label in zip(X, y):
+        key = text if isinstance(text, type(u'')) else text.decode('utf-8')
+        key = (unicodedata.normalize('NFD', key), label)
+        k = index.get(key)
+        if k is None:
+            k = index[key] = len(Xu)
+            Xu.append(text)
+            yu.append(label)
+            weights.append(0)
+        weights[k] += 1
+        inverse.append(k)
+
+    return Xu, yu, np.array(weights, dtype=np.float64), np.array(inverse, dtype=np.int64)
+
+
+def stratified_subsample(y, size, seed=0):
+    """Positions of a random sample of at most `size` pairs of each label, in increasing order"""
+    rng = np.random.RandomState(seed)
+    y = np.asarray(y)
+    index = [rng.permutation(np.where(y == label)[0])[:size] for label in np.unique(y)]
+    return np.sort(np.concatenate(index))
+
+
+MAGIC = b'B4MSA\x00\x00\x00'
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_arrays(filename, header, arrays):
+    """Stores the dictionary of numpy `arrays` and the JSON serializable `header`.
+    The file starts with a magic string, the format version and the length of the
+    JSON header, which describes the arrays; these follow as raw, aligned data."""
+    header = dict(header)
+    header['arrays'] = layout = {}
+    offset = 0
+    for k, v in sorted(arrays.items()):
+        layout[k] = dict(dtype=v.dtype.str, shape=list(v.shape), offset=offset)
+        offset = _align(offset + v.nbytes)
+
+    cdn = json.dumps(header, sort_keys=True).encode('utf-8')
+    start = _align(len(MAGIC) + 8 + len(cdn))
+    with open(filename, 'wb') as fpt:
+        fpt.write(MAGIC)
+        fpt.write(struct.pack('<II', FORMAT_VERSION, len(cdn)))
+        fpt.write(cdn)
+        for k, v in sorted(arrays.items()):
+            fpt.seek(start + layout[k]['offset'])
+            fpt.write(np.ascontiguousarray(v).tobytes())
+
+
+def is_array_file(filename):
+    with open(filename, 'rb') as fpt:
+        return fpt.read(len(MAGIC)) == MAGIC
+
+
+def load_arrays(filename, mmap_mode=None):
+    """Reads a file written by `save_arrays`; it returns the header and the arrays.
+    With `mmap_mode` (e.g., 'r') the arrays are memory-mapped instead of read,
+    so processes loading the same file share its pages."""
+    with open(filename, 'rb') as fpt:
+        if fpt.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{0} is not a b4msa model file".format(filename))
+
+        version, size = struct.unpack('<II', fpt.read(8))
+        if version > FORMAT_VERSION:
+            raise ValueError("Unsupported model format version {0}".format(version))
+
+        header = json.loads(fpt.read(size).decode('utf-8'))
+        start = _align(len(MAGIC) + 8 + size)
+        arrays = {}
+        for k, v in header['arrays'].items():
+            dtype = np.dtype(str(v['dtype']))
+            shape = tuple(v['shape'])
+            count = int(np.prod(shape))
+            if mmap_mode is not None and count > 0:
+                arrays[k] = np.memmap(filename, dtype=dtype, mode=mmap_mode,
+                                      offset=start + v['offset'], shape=shape)
+                continue
+
+            fpt.seek(start + v['offset'])
+            arrays[k] = np.fromfile(fpt, dtype=dtype, count=count).reshape(shape)
+
+    return header, arrays
+
+
+def share_arrays(arrays, header={}):
+    """Stores `arrays` in a temporary file, in shared memory when available, to be
+    memory-mapped by other processes with `attach_arrays`; it returns the file name,
+    the caller removes the file when it is no longer needed"""
+    dirname = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    fd, filename = tempfile.mkstemp(prefix='b4msa-', dir=dirname)
+    os.close(fd)
+    save_arrays(filename, header, arrays)
+    return filename
+
+
+_ATTACHED = OrderedDict()
+
+
+def attach_arrays(filename, max_attached=4):
+    """Header and read-only memory-mapped arrays of a file written by `share_arrays`;
+    each process maps a file once, keeping the `max_attached` most recent ones"""
+    value = _ATTACHED.pop(filename, None)
+    if value is None:
+        value = load_arrays(filename, mmap_mode='r')
+        while len(_ATTACHED) >= max_attached:
+            _ATTACHED.popitem(last=False)
+    _ATTACHED[filename] = value
+    return value
+
+
+def texts_to_arrays(texts):
+    """Encodes `texts` as their concatenated utf-8 bytes and the offset of each one"""
+    data = [(x if x is not None else u'').encode('utf-8') for x in texts]
+    offsets = np.cumsum([0] + [len(x) for x in data]).astype(np.int64)
+    return np.frombuffer(b''.join(data), dtype=np.uint8), offsets
+
+
+def arrays_to_texts(data, offsets):
+    data = np.asarray(data).tobytes()
+    offsets = np.asarray(offsets).tolist()
+    return [data[a:b].decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+
+
 # def pos_neg_f1(y, hy):
 #     return f1_score(y, hy, average=None)[:2].mean()
@@ -55,5 +55,6 @@ setup(
              'b4msa/tools/b4msa-params',
              'b4msa/tools/b4msa-perf',
              'b4msa/tools/b4msa-kfolds',
-             'b4msa/tools/b4msa-textModel']
+             'b4msa/tools/b4msa-textModel',
+             'b4msa/tools/b4msa-quantize']
 )